@@ -1,104 +1,195 @@
-import re
+from string import ascii_letters
+from math import isfinite, gcd
+from itertools import count
+from fractions import Fraction
+from functools import lru_cache
+from random import randrange
+from metrics import METRICS
+from errors import ParseError, EvalError # re-exported
 
-NUM_RE = re.compile(r'-?(?:(?:[1-9]\d*|0)(?:\.\d*)?|\.\d+)')
-IDTF_RE = re.compile(r'[A-Za-z]+')
-TOK_RE = re.compile(rf'\s*([+\-*/()]|{NUM_RE.pattern}|{IDTF_RE.pattern}|\S)\s*')
+LETTERS = frozenset(ascii_letters)
+np = None # numpy once load_numpy has run, False if it is not installed
+FLIP = {'+': '-', '-': '+'}
+XPN_BITS = 32 # exponent field width per variable in a packed monomial key
+MOD = (1 << 61) - 1 # prime modulus for randomised identity checks
+IDENT_PTS = 8
 TOLER = {'abs': 1e-9, 'rel': 1e-9}
 is_approx = lambda a, b: abs(a - b) < max(TOLER['abs'], TOLER['rel'] * max(abs(a), abs(b)))
 INVALID = """Invalid token `{tok}` identified at position `{pos}`.
 The only allowed operations are currently: `+`, `-`, `*`, `/`, and parentheses `(`, `)`."""
 OUT_DOM = "{calc}: The arguments provided are outside the domain, the function value is not well-defined."
 
-class ParseError(Exception):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.msg = msg
-class EvalError(Exception):
-    def __init__(self, msg):
-        super().__init__(msg)
-        self.msg = msg
+def load_numpy(): # deferred to the first batch evaluation, as nothing else needs numpy
+    global np
+    if np is None:
+        try:
+            import numpy as np
+        except ImportError:
+            np = False
+    return np
+
+def scan_digits(text, i):
+    while i < len(text) and text[i].isdecimal():
+        i += 1
+    return i
+
+def tokenize(fn_exp):
+    # (kind, token) pairs in one pass, kind being 'num', 'idtf', or the character itself for anything else
+    # numbers as -?(?:(?:[1-9]\d*|0)(?:\.\d*)?|\.\d+) without the sign, identifiers as [A-Za-z]+, whitespace skipped
+    tokens = []
+    i = 0
+    while i < len(fn_exp):
+        char = fn_exp[i]
+        if char in '123456789' or char == '0':
+            end = i + 1 if char == '0' else scan_digits(fn_exp, i + 1)
+            if end < len(fn_exp) and fn_exp[end] == '.':
+                end = scan_digits(fn_exp, end + 1)
+            tokens.append(('num', fn_exp[i:end]))
+        elif char == '.' and i + 1 < len(fn_exp) and fn_exp[i + 1].isdecimal():
+            end = scan_digits(fn_exp, i + 1)
+            tokens.append(('num', fn_exp[i:end]))
+        elif char in LETTERS:
+            end = i + 1
+            while end < len(fn_exp) and fn_exp[end] in LETTERS:
+                end += 1
+            tokens.append(('idtf', fn_exp[i:end]))
+        elif char.isspace():
+            end = i + 1
+        else:
+            end = i + 1
+            tokens.append((char, char))
+        i = end
+    return tokens
+
+def is_num(tok): # the whole of tok is one number, optionally negative
+    whole, dot, frac = (tok[1:] if tok[:1] == '-' else tok).partition('.')
+    if whole == '':
+        return dot != '' and frac.isdecimal()
+    return (whole == '0' or (whole[0] in '123456789' and whole.isdecimal())) and (frac == '' or frac.isdecimal())
+
+def is_idtf(tok):
+    return tok.isascii() and tok.isalpha()
 
 def recurse(*, num_base, var_base, neg_mod, tree_mod=lambda x: x):
     def deco(accum):
         def wrap(self, *args):
-            if self.oper == 'num':
-                return num_base(self, *args)
-            elif self.oper == 'var':
-                return var_base(self, *args)
-            elif self.oper == 'neg':
-                return neg_mod(wrap(self.value, *args))
-            trees = [tree_mod(wrap(val, *args)) for val in self.value]
-            stuff = trees[0]
-            for op, tree in zip(self.oper, trees[1:]):
-                stuff = accum(stuff, op, tree)
-            return stuff
+            memo = {} if self.interned else None
+            stack = [(self, False)]
+            outs = []
+            while stack:
+                node, ready = stack.pop()
+                if memo is not None and id(node) in memo:
+                    outs.append(memo[id(node)])
+                    continue
+                if node.oper == 'num':
+                    stuff = num_base(node, *args)
+                elif node.oper == 'var':
+                    stuff = var_base(node, *args)
+                elif not ready:
+                    stack.append((node, True))
+                    stack.extend((val, False) for val in ([node.value] if node.oper == 'neg' else reversed(node.value)))
+                    continue
+                elif node.oper == 'neg':
+                    stuff = neg_mod(outs.pop())
+                else:
+                    trees = [tree_mod(tree) for tree in outs[-len(node.value):]]
+                    del outs[-len(node.value):]
+                    stuff = trees[0]
+                    for op, tree in zip(node.oper, trees[1:]):
+                        stuff = accum(stuff, op, tree)
+                if memo is not None:
+                    memo[id(node)] = stuff
+                outs.append(stuff)
+            return outs[0]
         return wrap
     return deco
 
 class AST:
-    def __init__(self, oper, value):
+    # n-ary nodes keep their operators as one string ('+-*/' chars) and their operands as a tuple
+    __slots__ = ('oper', 'value', 'interned')
+    
+    def __init__(self, oper, value, interned=False):
         self.oper = oper
         self.value = value
+        self.interned = interned # whether subtrees may be shared, making the tree a DAG
     
     @classmethod
-    def from_expr(cls, idcs, fn_exp):
-        def parse_expr():
-            nonlocal pos
-            opers = []
-            terms = [parse_term()]
-            while pos < len(tokens) and tokens[pos] in ['+', '-']:
-                opers.append(tokens[pos])
-                pos += 1
-                terms.append(parse_term())
-            return terms[0] if len(opers) == 0 else cls(opers, terms)
-        
-        def parse_term():
-            nonlocal pos
-            opers = []
-            facts = [parse_fact()]
-            while pos < len(tokens) and tokens[pos] in ['*', '/']:
-                opers.append(tokens[pos])
-                pos += 1
-                facts.append(parse_term())
-            return facts[0] if len(opers) == 0 else cls(opers, facts)
+    def from_expr(cls, idcs, fn_exp, intern=False):
+        def make(oper, value):
+            if not intern:
+                return cls(oper, value)
+            if oper in ['num', 'var']:
+                key = oper, value
+            elif oper == 'neg':
+                key = oper, id(value)
+            else:
+                key = oper, tuple(map(id, value))
+            if key not in nodes:
+                nodes[key] = cls(oper, value, True)
+            return nodes[key]
         
         def parse_fact():
             nonlocal pos
             neg = False
-            while pos < len(tokens) and tokens[pos] == '-':
+            while pos < len(tokens) and tokens[pos][0] == '-':
                 neg = not neg
                 pos += 1
             if pos >= len(tokens):
                 raise ParseError(f"Missing token expected at position {pos}")
-            tok = tokens[pos]
-            if NUM_RE.fullmatch(tok):
-                fact = cls('num', float(tok))
-                pos += 1
-            elif IDTF_RE.fullmatch(tok):
+            kind, tok = tokens[pos]
+            if kind == 'num':
+                fact = make('num', float(tok))
+            elif kind == 'idtf':
                 if tok not in idcs:
                     raise ParseError(f"The variable `{tok}` used at position `{pos}` is not provided in the list of parameters.")
-                fact = cls('var', idcs[tok])
-                pos += 1
-            elif tok == '(':
-                brack = pos
-                pos += 1
-                expr = parse_expr()
-                if tokens[pos] != ')':
-                    raise ParseError(f"The open parenthesis `(`at position `{brack}` has no corresponding close parenthesis `)` at position `{pos}`.")
+                fact = make('var', idcs[tok])
+            elif kind == '(':
+                stack.append(('paren', pos, neg))
+                stack.append(('expr', [], []))
                 pos += 1
-                fact = expr
+                return None
             else:
-                raise ParseError(INVALID.format(pos=pos))
-            return cls('neg', fact) if neg else fact
+                raise ParseError(INVALID.format(tok=tok, pos=pos))
+            pos += 1
+            return make('neg', fact) if neg else fact
         
-        tokens = TOK_RE.findall(fn_exp)
+        # expr := term {(+|-) term}, term := fact [(*|/) term], fact := {-} (num | var | "(" expr ")")
+        # with the pending expr, term and paren levels kept on an explicit stack instead of the call stack
+        tokens = tokenize(fn_exp)
+        nodes = {} # structural key: node, children keyed by id as they are already unique
         pos = 0
-        self = parse_expr()
-        if len(tokens) > pos:
-            raise ParseError(f"Extraneous token `{tokens[pos]}` identified at position `{pos}`, after the end of the expression.")
-        return self
+        stack = [('expr', [], [])]
+        while True:
+            fact = parse_fact()
+            while fact is not None:
+                if pos < len(tokens) and tokens[pos][0] in ['*', '/']:
+                    stack.append(('term', tokens[pos][0], fact))
+                    pos += 1
+                    break
+                term = fact
+                while stack[-1][0] == 'term':
+                    _, op, left = stack.pop()
+                    term = make(op, (left, term))
+                _, opers, terms = stack[-1]
+                terms.append(term)
+                if pos < len(tokens) and tokens[pos][0] in ['+', '-']:
+                    opers.append(tokens[pos][0])
+                    pos += 1
+                    break
+                stack.pop()
+                expr = terms[0] if len(opers) == 0 else make(''.join(opers), tuple(terms))
+                if not stack:
+                    if len(tokens) > pos:
+                        raise ParseError(f"Extraneous token `{tokens[pos][1]}` identified at position `{pos}`, after the end of the expression.")
+                    return expr
+                _, brack, neg = stack.pop()
+                if pos >= len(tokens) or tokens[pos][0] != ')':
+                    raise ParseError(f"The open parenthesis `(`at position `{brack}` has no corresponding close parenthesis `)` at position `{pos}`.")
+                pos += 1
+                fact = make('neg', expr) if neg else expr
     
     
+    @METRICS.timed('eval_at')
     @recurse(num_base=lambda self, args: self.value,
              var_base=lambda self, args: args[self.value],
              neg_mod=lambda x: -x)
@@ -113,25 +204,199 @@ class AST:
             if val == 0: raise EvalError(OUT_DOM.format(calc="Division by zero"))
             return rslt / val
     
-    @recurse(num_base=lambda self, arity: ({(0,) * arity: self.value}, {(0,) * arity: 1}),
-             var_base=lambda self, arity: ({tuple(1 if i == self.value else 0 for i in range(arity)): 1}, {(0,) * arity: 1}),
+    @recurse(num_base=lambda self, arity: ({0: self.value}, {0: 1}),
+             var_base=lambda self, arity: ({1 << XPN_BITS * self.value: 1}, {0: 1}),
              neg_mod=lambda poly: ({xpn: -coef for xpn, coef in poly[0].items()}, poly[1]))
     def to_poly(poly, op, val):
-        top, bottom = poly
+        return poly_op(poly, op, val)
+    
+    # as to_poly but with integer coefficients, literals taken as the exact decimals they were written as
+    @recurse(num_base=lambda self, arity: tuple({0: part} for part in exact_frac(self.value).as_integer_ratio()),
+             var_base=lambda self, arity: ({1 << XPN_BITS * self.value: 1}, {0: 1}),
+             neg_mod=lambda poly: ({xpn: -coef for xpn, coef in poly[0].items()}, poly[1]))
+    def to_ratpoly(poly, op, val):
+        return norm_poly(*poly_op(poly, op, val))
+    
+    @recurse(num_base=lambda self, cols: (self.value, False),
+             var_base=lambda self, cols: (cols[self.value], False),
+             neg_mod=lambda col: (-col[0], col[1]))
+    def eval_cols(col, op, val):
+        rslt, bad = col
+        vals, wrong = val
+        if op == '+':
+            return rslt + vals, bad | wrong
+        elif op == '-':
+            return rslt - vals, bad | wrong
+        elif op == '*':
+            return rslt * vals, bad | wrong
+        elif op == '/':
+            zero = vals == 0
+            return rslt / np.where(zero, 1, vals), bad | wrong | zero
+    
+    def eval_batch(self, args_matrix):
+        load_numpy()
+        args = np.asarray(args_matrix, dtype=float)
+        if args.ndim != 2:
+            raise ValueError(f"Expected an (N, arity) matrix of arguments, got shape {args.shape}.")
+        with np.errstate(over='ignore', invalid='ignore'):
+            rslt, bad = self.eval_cols(args.T)
+        rslt = np.broadcast_to(rslt, len(args)).astype(float)
+        bad = np.broadcast_to(bad, len(args)).copy()
+        rslt[bad] = np.nan
+        return rslt, bad
+    
+    def postorder(self):
+        seen = set()
+        stack = [(self, False)]
+        while stack:
+            node, ready = stack.pop()
+            if id(node) in seen:
+                continue
+            if ready or node.oper in ['num', 'var']:
+                seen.add(id(node))
+                yield node
+                continue
+            stack.append((node, True))
+            stack.extend((val, False) for val in ([node.value] if node.oper == 'neg' else reversed(node.value)))
+    
+    def dump(self):
+        index = {} # id(node): position in code
+        code = []
+        for node in self.postorder():
+            index[id(node)] = len(code)
+            if node.oper in ['num', 'var']:
+                code.append((node.oper, node.value))
+            elif node.oper == 'neg':
+                code.append(('neg', index[id(node.value)]))
+            else:
+                code.append((node.oper, tuple(index[id(val)] for val in node.value)))
+        return self.interned, code
+    
+    @classmethod
+    def load(cls, dumped):
+        interned, code = dumped
+        nodes = []
+        for oper, value in code:
+            if oper == 'neg':
+                value = nodes[value]
+            elif oper not in ['num', 'var']:
+                value = tuple(nodes[i] for i in value)
+            nodes.append(cls(oper, value, interned))
+        return nodes[-1]
+    
+    # the same function with fewer nodes: neg nodes folded into literals, +/- chains or one outer neg,
+    # chains flattened (a right chain only after + or *, so never under /), constant prefixes folded and +0, -0, *1, /1 dropped
+    # a chain used only by the chain it is flattened into is never built alone, so each node is visited once however long the chain
+    # in exact arithmetic this is the same function with the same domain, as division by a zero literal is never folded,
+    # but constants are folded in floating point and flattening a right chain reassociates, so values may differ by rounding,
+    # and a divisor that is identically zero may round to exactly zero in one tree but not the other, putting that point
+    # outside the domain of only one of them
+    def simplify(self):
+        nodes = list(self.postorder())
+        uses = {} # id(node): number of parents
+        for node in nodes:
+            for val in [node.value] if node.oper == 'neg' else [] if node.oper in ['num', 'var'] else node.value:
+                uses[id(val)] = uses.get(id(val), 0) + 1
+        joins = {} # id(node): op joining it into its only parent's chain, for nodes flattened there rather than simplified alone
+        for node in reversed(nodes): # parents first
+            if node.oper == 'neg':
+                pairs = [(joins[id(node)], node.value)] if id(node) in joins else []
+            elif node.oper not in ['num', 'var']:
+                pairs = zip(('+' if node.oper[0] in FLIP else '*') + node.oper, node.value)
+            else:
+                continue
+            for op, val in pairs:
+                if uses[id(val)] == 1 and (val.oper == 'neg' and val.value.oper not in ['num', 'var']
+                                           or val.oper[0] in FLIP and op in FLIP or val.oper[0] in '*/' and op == '*'):
+                    joins[id(val)] = op
+        simple = {} # id(node): simplified node
+        for node in nodes:
+            if id(node) in joins:
+                continue
+            if node.oper in ['num', 'var']:
+                simple[id(node)] = node
+            elif node.oper == 'neg':
+                simple[id(node)] = negate(simple[id(node.value)])
+            else:
+                simple[id(node)] = (join_sum if node.oper[0] in FLIP else join_prod)(node, simple, joins)
+        return simple[id(self)]
+    
+    def to_func(self):
+        lines = []
+        temps = count()
+        names = {} # id(node): name, so shared subtrees are computed once
+        def assign(expr):
+            temp = f"t{next(temps)}"
+            lines.append(f"{temp} = {expr}")
+            return temp
+        
+        for node in self.postorder():
+            if node.oper == 'num':
+                rslt = repr(node.value) if isfinite(node.value) else f"float('{node.value}')"
+            elif node.oper == 'var':
+                rslt = f"args[{node.value}]"
+            elif node.oper == 'neg':
+                rslt = assign(f"-{names[id(node.value)]}")
+            else:
+                vals = [names[id(val)] for val in node.value]
+                rslt = vals[0]
+                for op, val in zip(node.oper, vals[1:]):
+                    if op == '/':
+                        lines.append(f"if {val} == 0: raise EvalError(DIV_ZERO)")
+                    rslt = assign(f"{rslt} {op} {val}")
+            names[id(node)] = rslt
+        rslt = names[id(self)]
+        src = "def func(args):\n" + ''.join(f"    {line}\n" for line in lines) + f"    return {rslt}\n"
+        scope = {'EvalError': EvalError, 'DIV_ZERO': OUT_DOM.format(calc="Division by zero")}
+        exec(compile(src, "<game function>", 'exec'), scope)
+        return scope['func']
+    
+    @recurse(num_base=lambda self, point: (mod_frac(self.value), 1),
+             var_base=lambda self, point: (point[self.value], 1),
+             neg_mod=lambda frac: (-frac[0] % MOD, frac[1]))
+    def to_mod(frac, op, val):
+        top, bottom = frac
         up, down = val
         if op == '+':
-            return add_poly(mult_poly(top, down), mult_poly(bottom, up)), mult_poly(bottom, down)
+            return (top * down + bottom * up) % MOD, bottom * down % MOD
         elif op == '-':
-            minus = {xpn: -coef for xpn, coef in mult_poly(bottom, up).items()}
-            return add_poly(mult_poly(top, down), minus), mult_poly(bottom, down)
+            return (top * down - bottom * up) % MOD, bottom * down % MOD
         elif op == '*':
-            return mult_poly(top, up), mult_poly(bottom, down)
+            return top * up % MOD, bottom * down % MOD
         elif op == '/':
-            return mult_poly(top, down), mult_poly(bottom, up)
+            return top * down % MOD, bottom * up % MOD
+    
+    def may_ident(self, other, arity):
+        # cross-multiplied like is_ident, so points where a denominator vanishes never divide
+        # exact, so only a valid pre-check for the exact has_poly: the float one accepts within TOLER
+        try:
+            for _ in range(IDENT_PTS):
+                point = [randrange(MOD) for _ in range(arity)]
+                top, bottom = self.to_mod(point)
+                up, down = other.to_mod(point)
+                if top * down % MOD != bottom * up % MOD:
+                    return False
+        except ValueError: # non-finite literal, leave it to the symbolic check
+            pass
+        return True
     
-    def is_ident(self, other, arity):
+    @METRICS.timed('is_ident')
+    def is_ident(self, other, arity, poly=None, exact=False):
+        if poly is None:
+            poly = other.to_ratpoly(arity) if exact else other.to_poly(arity)
+        return (not exact or self.may_ident(other, arity)) and self.has_poly(poly, arity, exact)
+    
+    def has_poly(self, poly, arity, exact=False):
+        # poly as given by to_ratpoly if exact, else by to_poly
+        if exact:
+            try:
+                top, bottom = self.to_ratpoly(arity)
+            except ValueError: # non-finite literal, so never equal to an exact poly
+                return False
+            up, down = poly
+            return mult_poly(top, down) == mult_poly(bottom, up)
         top, bottom = self.to_poly(arity)
-        up, down = other.to_poly(arity)
+        up, down = poly
         poly1, poly2 = mult_poly(top, down), mult_poly(bottom, up)
         for xpn in poly1 | poly2:
             if not is_approx(poly1.get(xpn, 0), poly2.get(xpn, 0)):
@@ -139,15 +404,132 @@ class AST:
         return True
     
 
-def add_poly(poly1, poly2):
-    total = poly1.copy()
-    for xpn, coef in poly2.items():
-        total[xpn] = total.get(xpn, 0) + coef
+@lru_cache(maxsize=1024)
+def exact_frac(value): # the shortest decimal that parses to value, so the literal itself for up to 15 significant digits
+    return Fraction(repr(value))
+
+def mod_frac(value):
+    top, bottom = exact_frac(value).as_integer_ratio()
+    return top * pow(bottom, -1, MOD) % MOD
+
+def poly_op(poly, op, val):
+    top, bottom = poly
+    up, down = val
+    if op == '+':
+        return add_poly(mult_poly(top, down), mult_poly(bottom, up)), mult_poly(bottom, down)
+    elif op == '-':
+        return add_poly(mult_poly(top, down), mult_poly(bottom, up), -1), mult_poly(bottom, down)
+    elif op == '*':
+        return mult_poly(top, up), mult_poly(bottom, down)
+    elif op == '/':
+        return mult_poly(top, down), mult_poly(bottom, up)
+
+def norm_poly(top, bottom): # divide out the integer content shared by numerator and denominator
+    div = gcd(*top.values(), *bottom.values())
+    if div > 1:
+        top = {xpn: coef // div for xpn, coef in top.items()}
+        bottom = {xpn: coef // div for xpn, coef in bottom.items()}
+    return top, bottom
+
+def add_poly(total, poly, sign=1):
+    for xpn, coef in poly.items():
+        coef = total.get(xpn, 0) + sign * coef
+        if coef:
+            total[xpn] = coef
+        else:
+            total.pop(xpn, None)
     return total
 
 def mult_poly(poly1, poly2):
+    if len(poly1) < len(poly2):
+        poly1, poly2 = poly2, poly1
     total = {}
-    for xpn1, coef1 in poly1.items():
-        scaled = {tuple(a + b for a, b in zip(xpn1, xpn2, strict=True)): coef1 * coef2 for xpn2, coef2 in poly2.items()}
-        total = add_poly(total, scaled)
-    return total
+    for xpn2, coef2 in poly2.items():
+        for xpn1, coef1 in poly1.items():
+            xpn = xpn1 + xpn2
+            total[xpn] = total.get(xpn, 0) + coef1 * coef2
+    return {xpn: coef for xpn, coef in total.items() if coef}
+
+def negate(tree):
+    if tree.oper == 'num':
+        return AST('num', -tree.value, tree.interned)
+    if tree.oper == 'neg':
+        return tree.value
+    return AST('neg', tree, tree.interned)
+
+def join_sum(chain, simple, joins): # chain as one +/- chain of simplified terms, the chains joined into it flattened in
+    terms = []
+    stack = [('+', chain)]
+    while stack:
+        op, tree = stack.pop()
+        if tree is chain or id(tree) in joins:
+            if tree.oper == 'neg':
+                stack.append((FLIP[op], tree.value))
+            else:
+                stack.extend(reversed([(opr if op == '+' else FLIP[opr], val) for opr, val in zip('+' + tree.oper, tree.value)]))
+            continue
+        tree = simple[id(tree)]
+        if tree.oper == 'neg':
+            op, tree = FLIP[op], tree.value
+        if tree.oper[0] in FLIP:
+            terms += [(opr if op == '+' else FLIP[opr], term) for opr, term in zip('+' + tree.oper, tree.value)]
+        else:
+            terms.append((op, tree))
+    terms = [(opr, term) for opr, term in terms if term.oper != 'num' or term.value != 0]
+    if not terms:
+        return AST('num', 0.0, chain.interned)
+    if terms[0][0] == '-': # -a + b - c = -(a - b + c)
+        return negate(make_chain([(FLIP[opr], term) for opr, term in terms]))
+    return make_chain(terms)
+
+def join_prod(chain, simple, joins): # chain as one */ chain of simplified terms, the chains joined into it flattened in
+    neg = False
+    terms = []
+    stack = [('*', chain)]
+    while stack:
+        op, tree = stack.pop()
+        if tree is chain or id(tree) in joins:
+            if tree.oper == 'neg':
+                neg = not neg
+                stack.append((op, tree.value))
+            else:
+                stack.extend(reversed([(op, tree.value[0]), *zip(tree.oper, tree.value[1:])]))
+            continue
+        tree = simple[id(tree)]
+        if tree.oper == 'neg':
+            neg, tree = not neg, tree.value
+        if op == '*' and tree.oper[0] in '*/':
+            terms += zip('*' + tree.oper, tree.value)
+        else:
+            terms.append((op, tree))
+    prod = make_chain(terms)
+    return negate(prod) if neg else prod
+
+def make_chain(terms): # (op, term) pairs, the first op being the chain's identity op
+    first = terms[0][1]
+    rest = terms[1:]
+    while rest and first.oper == 'num' and rest[0][1].oper == 'num':
+        op, term = rest[0]
+        if op == '/' and term.value == 0:
+            break
+        if op == '+':
+            value = first.value + term.value
+        elif op == '-':
+            value = first.value - term.value
+        elif op == '*':
+            value = first.value * term.value
+        else:
+            value = first.value / term.value
+        if not isfinite(value):
+            break
+        first = AST('num', value, first.interned)
+        del rest[0]
+    if terms[0][0] == '*':
+        rest = [(op, term) for op, term in rest if term.oper != 'num' or term.value != 1]
+        if first.oper == 'num' and first.value == 1 and rest and rest[0][0] == '*':
+            first = rest.pop(0)[1]
+    elif first.oper == 'num' and first.value == 0 and rest and rest[0][0] == '+': # zero terms are dropped before folding, but may be folded to
+        first = rest.pop(0)[1]
+    if not rest:
+        return first
+    return AST(''.join(op for op, _ in rest), (first, *(term for _, term in rest)), first.interned)
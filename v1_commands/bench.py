@@ -0,0 +1,273 @@
+import os, re, sys, json, random, asyncio, argparse, subprocess, tracemalloc
+from time import perf_counter
+from types import SimpleNamespace
+from abstree import AST, tokenize, is_num, is_idtf
+from outbox import Outbox, Bucket, CHNL_RATE, GLOBAL_RATE
+import tools
+
+PARAMS = "xyzwuv"
+
+class DictAST: # node layout before AST.__slots__, for comparison
+    def __init__(self, oper, value):
+        self.oper = oper
+        self.value = value
+    
+
+NUM_RE = re.compile(r'-?(?:(?:[1-9]\d*|0)(?:\.\d*)?|\.\d+)') # the grammar before the scanner, for comparison
+IDTF_RE = re.compile(r'[A-Za-z]+')
+TOK_RE = re.compile(rf'\s*([+\-*/()]|{NUM_RE.pattern}|{IDTF_RE.pattern}|\S)\s*')
+SEP_RE = re.compile(r'\s*,\s*|\s+')
+
+def regex_tokenize(fn_exp):
+    return [('num' if NUM_RE.fullmatch(tok) else 'idtf' if IDTF_RE.fullmatch(tok) else tok, tok) for tok in TOK_RE.findall(fn_exp)]
+
+def regex_split(items):
+    items = SEP_RE.split(items)
+    return [] if items == [''] else items
+
+def to_dict_ast(tree):
+    nodes = {}
+    for node in tree.postorder():
+        if node.oper in ['num', 'var']:
+            nodes[id(node)] = DictAST(node.oper, node.value)
+        elif node.oper == 'neg':
+            nodes[id(node)] = DictAST('neg', nodes[id(node.value)])
+        else:
+            nodes[id(node)] = DictAST(list(node.oper), [nodes[id(val)] for val in node.value])
+    return nodes[id(tree)]
+
+def rand_expr(rng, arity, size, depth=8, lits=None):
+    if size <= 1 or depth == 0:
+        if arity and rng.random() < 0.6:
+            return PARAMS[rng.randrange(arity)]
+        return rng.choice(lits) if lits else str(rng.randint(1, 9))
+    left = rng.randint(1, size - 1)
+    op = rng.choice("+-*/")
+    lhs, rhs = rand_expr(rng, arity, left, depth - 1, lits), rand_expr(rng, arity, size - left, depth - 1, lits)
+    return f"-({lhs}) {op} ({rhs})" if rng.random() < 0.1 else f"({lhs}) {op} ({rhs})"
+
+def measure(build):
+    tracemalloc.start()
+    kept = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, kept
+
+def timed(calls):
+    start = perf_counter()
+    worst = 0
+    for call in calls:
+        begin = perf_counter()
+        call()
+        worst = max(worst, perf_counter() - begin)
+    return {'mean_us': (perf_counter() - start) / len(calls) * 1e6, 'max_us': worst * 1e6}
+
+def bench_ops(sizes=(5, 20, 60), arities=(1, 3), depths=(4, 8), count=50, evals=20, seed=0):
+    rng = random.Random(seed)
+    rslts = []
+    for arity in arities:
+        idcs = {param: i for i, param in enumerate(PARAMS[:arity])}
+        head = f"({', '.join(PARAMS[:arity])}) "
+        for depth in depths:
+            for size in sizes:
+                exprs = [rand_expr(rng, arity, size, depth) for _ in range(count)]
+                trees = [AST.from_expr(idcs, expr) for expr in exprs]
+                points = [[float(rng.randint(-9, 9)) for _ in range(arity)] for _ in range(evals)]
+                polys = [tree.to_poly(arity) for tree in trees]
+                equivs = [AST.from_expr(idcs, f"(({expr}) + 0.1) * 0.3 / 0.3 - 0.1") for expr in exprs] # should be identical
+                tracemalloc.start()
+                for tree in trees:
+                    tree.is_ident(tree, arity)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                rslts.append({'arity': arity, 'depth': depth, 'size': size, 'exprs': count,
+                    'resolve_func': timed([lambda expr=expr: tools.resolve_func(head + expr, arity) for expr in exprs]),
+                    'from_expr': timed([lambda expr=expr: AST.from_expr(idcs, expr) for expr in exprs]),
+                    'eval_at': timed([lambda tree=tree, point=point: eval_safe(tree, point) for tree in trees for point in points]),
+                    'to_poly': timed([lambda tree=tree: tree.to_poly(arity) for tree in trees]),
+                    'is_ident': timed([lambda tree=tree: tree.is_ident(tree, arity) for tree in trees]),
+                    'to_ratpoly': timed([lambda tree=tree: tree.to_ratpoly(arity) for tree in trees]),
+                    'is_ident_exact': timed([lambda tree=tree: tree.is_ident(tree, arity, exact=True) for tree in trees]),
+                    'false_negatives': {'float': sum(not tree.has_poly(equiv.to_poly(arity), arity) for tree, equiv in zip(trees, equivs)),
+                        'exact': sum(not tree.has_poly(equiv.to_ratpoly(arity), arity, True) for tree, equiv in zip(trees, equivs))},
+                    'poly_terms_max': max(len(top) + len(bottom) for top, bottom in polys),
+                    'is_ident_peak_bytes': peak})
+    return rslts
+
+def eval_safe(tree, point):
+    try:
+        return tree.eval_at(point)
+    except tools.EvalError:
+        return None
+
+def bench_simplify(sizes=(5, 20, 60), arity=3, count=200, points=50, seed=0):
+    rng = random.Random(seed)
+    lits = ['0', '1', '2', '0.5', '3', '-1', '--2']
+    idcs = {param: i for i, param in enumerate(PARAMS[:arity])}
+    rslts = {}
+    for size in sizes:
+        trees = [AST.from_expr(idcs, rand_expr(rng, arity, size, lits=lits)) for _ in range(count)]
+        simples = [tree.simplify() for tree in trees]
+        grid = [[float(rng.choice([0, 1, -1, 2, rng.uniform(-9, 9)])) for _ in range(arity)] for _ in range(points)]
+        funcs, simple_funcs = [tree.to_func() for tree in trees], [simple.to_func() for simple in simples]
+        rslts[size] = {'nodes': {'before': sum(1 for tree in trees for _ in tree.postorder()), 'after': sum(1 for simple in simples for _ in simple.postorder())},
+            'simplify': timed([lambda tree=tree: tree.simplify() for tree in trees]),
+            'eval_at_us': {'before': timed([lambda tree=tree, point=point: eval_safe(tree, point) for tree in trees for point in grid])['mean_us'],
+                'after': timed([lambda simple=simple, point=point: eval_safe(simple, point) for simple in simples for point in grid])['mean_us']},
+            'to_func_us': {'before': timed([lambda func=func, point=point: call_safe(func, point) for func in funcs for point in grid])['mean_us'],
+                'after': timed([lambda func=func, point=point: call_safe(func, point) for func in simple_funcs for point in grid])['mean_us']}}
+    return rslts
+
+def call_safe(func, point):
+    try:
+        return func(point)
+    except tools.EvalError:
+        return None
+
+def bench_memory(count=2000, arity=3, size=30, seed=0):
+    rng = random.Random(seed)
+    idcs = {param: i for i, param in enumerate(PARAMS[:arity])}
+    exprs = [rand_expr(rng, arity, size) for _ in range(count)]
+    trees = [AST.from_expr(idcs, expr) for expr in exprs]
+    nodes = sum(1 for tree in trees for _ in tree.postorder())
+    slotted, _ = measure(lambda: [AST.from_expr(idcs, expr) for expr in exprs])
+    interned, _ = measure(lambda: [AST.from_expr(idcs, expr, True) for expr in exprs])
+    dicted, _ = measure(lambda: [to_dict_ast(tree) for tree in trees])
+    return {'trees': count, 'nodes': nodes,
+            'bytes': {'dict': dicted, 'slots': slotted, 'slots_interned': interned},
+            'bytes_per_node': {'dict': dicted / nodes, 'slots': slotted / nodes, 'slots_interned': interned / nodes}}
+
+async def uncached_pfx(bot, msg): # cmd_pfx before its prefix cache
+    guild = msg.guild or bot.choices.get(msg.author.id)
+    if guild:
+        return bot.servers[guild.id].prefix
+    return bot.dft_pfx
+
+def run_coro(coro): # cmd_pfx never awaits, so drive it without an event loop
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+def bench_prefix(guild_counts=(10, 1000, 100000), msgs=200000, seed=0):
+    from io_bot import cmd_pfx
+    rng = random.Random(seed)
+    rslts = {}
+    for count in guild_counts:
+        guilds = [SimpleNamespace(id=(i + 1) << 22) for i in range(count)]
+        users = [SimpleNamespace(id=(count + i + 1) << 22) for i in range(count)]
+        bot = SimpleNamespace(dft_pfx='.', prefixes={}, servers={guild.id: SimpleNamespace(prefix='!') for guild in guilds},
+                              choices={user.id: rng.choice(guilds) for user in users if rng.random() < 0.8})
+        batch = [SimpleNamespace(guild=rng.choice(guilds) if rng.random() < 0.5 else None, author=rng.choice(users)) for _ in range(msgs)]
+        rslts[count] = {}
+        for name, resolve in [('uncached', uncached_pfx), ('cached', cmd_pfx)]:
+            for msg in batch: # warm up, filling the cache
+                run_coro(resolve(bot, msg))
+            start = perf_counter()
+            for msg in batch:
+                run_coro(resolve(bot, msg))
+            rslts[count][name] = (perf_counter() - start) / msgs * 1e9
+    return {'ns_per_message': rslts}
+
+def bench_scan(lengths=(10, 100, 1000, 10000), checks=20000, chars=200000, seed=0):
+    rng = random.Random(seed)
+    alphabet = "xyz0123456789.+-*/() ,\t\u00a0\u0661e"
+    for _ in range(checks): # the scanner agrees with the regexes on arbitrary input
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+        assert tokenize(text) == regex_tokenize(text), text
+        assert tools.split_list(text.strip()) == regex_split(text.strip()), text
+        assert is_num(text) == bool(NUM_RE.fullmatch(text)) and is_idtf(text) == bool(IDTF_RE.fullmatch(text)), text
+    rslts = {}
+    for length in lengths:
+        expr = ''
+        while len(expr) < length:
+            expr += f"{' + ' if expr else ''}{rand_expr(rng, 3, 8)}"
+        call = ''
+        while len(call) < length:
+            call += f"{', ' if call else ''}{rng.uniform(-99, 99):.3f}"
+        reps = max(1, chars // length)
+        # the list split is on par with the regex one, within run-to-run noise: float and the per-item check dominate
+        rslts[length] = {
+            'tokenize_us': {'regex': timed([lambda: regex_tokenize(expr)] * reps)['mean_us'], 'scan': timed([lambda: tokenize(expr)] * reps)['mean_us']},
+            'split_us': {'regex': timed([lambda: [float(arg) for arg in regex_split(call) if NUM_RE.fullmatch(arg)]] * reps)['mean_us'],
+                'scan': timed([lambda: [float(arg) for arg in tools.split_list(call) if is_num(arg)]] * reps)['mean_us']}}
+    return rslts
+
+class FakeChannel: # local transport standing in for Discord, holding each send back as its rate limits would
+    def __init__(self, id, latency, rate, glob):
+        self.id = id
+        self.latency = latency
+        self.bucket = Bucket(*rate)
+        self.glob = glob
+        self.msgs = []
+    
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(max(self.bucket.delay(), self.glob.delay()) + self.latency)
+        self.msgs.append(content)
+    
+
+async def run_replies(users, burst, latency, scale, queued):
+    rate, glob = (CHNL_RATE[0], CHNL_RATE[1] * scale), Bucket(GLOBAL_RATE[0], GLOBAL_RATE[1] * scale)
+    chnls = [FakeChannel(i, latency, rate, glob) for i in range(users)]
+    outbox = Outbox(rate, (GLOBAL_RATE[0], GLOBAL_RATE[1] * scale))
+    handled = []
+    async def handle(chnl, i):
+        start = perf_counter()
+        if queued:
+            outbox.post(chnl, f"Your query result is `{i}`.")
+        else:
+            await chnl.send(f"Your query result is `{i}`.")
+        handled.append(perf_counter() - start)
+    start = perf_counter()
+    await asyncio.gather(*(handle(chnl, i) for chnl in chnls for i in range(burst)))
+    await outbox.flush()
+    return {'api_calls': sum(len(chnl.msgs) for chnl in chnls), 'handler_mean_ms': sum(handled) / len(handled) * 1e3,
+            'handler_max_ms': max(handled) * 1e3, 'delivered_ms': (perf_counter() - start) * 1e3}
+
+def bench_outbox(users=(1, 20, 100), burst=10, latency=0.002, scale=0.01):
+    # rate limit windows are scaled down by scale so the suite runs in seconds
+    return {count: {mode: asyncio.run(run_replies(count, burst, latency, scale, mode == 'outbox')) for mode in ['direct', 'outbox']}
+            for count in users}
+
+def import_times(stmt): # cumulative microseconds per module, from -X importtime in a fresh interpreter
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', stmt], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        own, cumul, name = line[len('import time:'):].split('|')
+        if cumul.strip().isdecimal():
+            times[name.strip()] = {'self_us': int(own), 'cumulative_us': int(cumul)}
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.splitlines()[-1])
+    return times
+
+def bench_import(modules=('io_bot', 'server', 'game_cog', 'misc_cog'), deferred=('tabulate', 'numpy'), top=10):
+    startup = import_times(f"import {', '.join(modules)}")
+    warm = import_times(f"import {', '.join(modules)}; import abstree, tools; abstree.load_numpy(); tools.table_format()")
+    return {'startup': {name: startup[name] for name in modules},
+            'startup_total_us': sum(times['self_us'] for times in startup.values()),
+            'deferred': {name: warm.get(name) for name in deferred if name not in startup},
+            'heaviest': dict(sorted(startup.items(), key=lambda item: -item[1]['self_us'])[:top])}
+
+SUITES = {'ops': bench_ops, 'scan': bench_scan, 'simplify': bench_simplify, 'memory': bench_memory, 'prefix': bench_prefix, 'outbox': bench_outbox, 'import': bench_import} # prefix and import need discord.py installed
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the parser, evaluator and identity checker.")
+    parser.add_argument('suites', nargs='*', default=['ops', 'memory'], choices=list(SUITES))
+    parser.add_argument('-o', '--out', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    rslts = {'commit': commit(), 'python': sys.version.split()[0]}
+    rslts.update((suite, SUITES[suite]()) for suite in args.suites)
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(rslts, file, indent=4)
+    else:
+        json.dump(rslts, sys.stdout, indent=4)
+        print()
@@ -0,0 +1,9 @@
+# kept apart from abstree, which reloads.refresh may reload, as live games keep trees and compiled functions raising these
+class ParseError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
+class EvalError(Exception):
+    def __init__(self, msg):
+        super().__init__(msg)
+        self.msg = msg
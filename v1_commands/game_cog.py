@@ -1,8 +1,9 @@
 import re
-from tabulate import tabulate
+import asyncio
 from typing import Optional
 from discord.ext.commands import command, check, dm_only, guild_only, Cog
-import abstree, tools
+import abstree, tools, reloads
+from metrics import METRICS
 
 NOT_CHSN = """You have not chosen a server to play in.
 To choose one, use `{pfx}choose_server <server>` with the server ID/name, or `here` in the server.""" # inline
@@ -18,8 +19,17 @@ PRVD = """No {kind} identified.
 Provide a {kind}{task}, using `{pfx}{cmd.name} {cmd.usage}`."""
 INVLD_GV = """Invalid guess value `{gval}` identified.
 Your guess value must be numeric only.""" # inline
+TIMEOUT = """Verification of your submission timed out, so it counts as wrong.
+Try submitting a simpler equivalent expression."""
+ENDED = "The game in your chosen server finished while your submission was being verified."
+TOO_MANY = """`{count}` argument lists identified.
+At most `{max}` argument lists can be queried at once."""
+LB_COUNT = 10
+VP_COUNT = 10
+BATCH_MAX = 20
 EMOJI = {'tick': '\N{square root}', 'cross': 'X'} # u2714 heavy check mark, u2716 heavy multiplication x, u221A square root
-PTS = {'query': 1, 'guess': {'correct': 0, 'wrong': 2}, 'submit': {'correct': 0, 'wrong': 1}}
+RANK = "You are ranked `#{rank}` of `{count}` player(s), with `{pts}` point(s)."
+NOT_PLYD = "You have not played in the current game in {what}."
 VP_FMT = """Your past queries:
 ```{query_tbl}```
 Your past guesses:
@@ -41,37 +51,33 @@ class Game(Cog):
     async def begin_game(self, ctx, *, func: Optional[str]):
         server = self.bot.servers[ctx.guild.id]
         if server.anc_chnl is None:
-            await ctx.send(NO_ANC.format(pfx=ctx.prefix))
+            self.bot.outbox.post(ctx, NO_ANC.format(pfx=ctx.prefix))
             return
         if server.arity >= 0:
-            await ctx.send(RUNNING.format(whether="already a", what="this server"))
+            self.bot.outbox.post(ctx, RUNNING.format(whether="already a", what="this server"))
             return
         if func is None:
-            await ctx.send(PRVD.format(kind="function", task=" to begin a game", pfx=ctx.prefix, cmd=ctx.command))
+            self.bot.outbox.post(ctx, PRVD.format(kind="function", task=" to begin a game", pfx=ctx.prefix, cmd=ctx.command))
             return
         try:
-            params, _, server.tree = tools.resolve_func(func)
+            server.start_game(func, self.bot.exact)
         except (tools.ResolveError, abstree.ParseError) as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
-        server.arity = len(params)
-        await server.anc_chnl.send(BEGUN.format(ptcp=server.ptcp_role.mention if server.ptcp_role else '', arity=server.arity, pfx=ctx.prefix))
+        self.bot.store.save(server)
+        self.bot.outbox.post(server.anc_chnl, BEGUN.format(ptcp=server.ptcp_role.mention if server.ptcp_role else '', arity=server.arity, pfx=ctx.prefix))
     
     @check(tools.has_ctrl)
     @command(aliases=["finish", "fg"], brief="Finish the current game")
     async def finish_game(self, ctx):
         server = self.bot.servers[ctx.guild.id]
         if server.arity == -1:
-            await ctx.send(RUNNING.format(whether="no", what="this server"))
-            return
-        server.arity = -1
-        server.tree = None
-        server.players = set()
-        server.queries = {}
-        server.guesses = {}
-        server.submxns = {}
-        server.winners = set()
-        await server.anc_chnl.send(FINISH.format(lb=calc_lb(server)))
+            self.bot.outbox.post(ctx, RUNNING.format(whether="no", what="this server"))
+            return
+        lb = tbl_lb(server)
+        server.reset_game()
+        self.bot.store.end_game(server)
+        self.bot.outbox.post(server.anc_chnl, FINISH.format(lb=lb))
         
     @dm_only()
     @command(usage="(<argument_list>)", brief="Query a function value")
@@ -79,22 +85,63 @@ class Game(Cog):
         try:
             server = ask(self.bot, ctx.author, ctx.prefix, kwari, kind="query", task='', cmd=ctx.command)
         except AskError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
         try:
             args, _ = tools.resolve_call(kwari, server.arity)
         except tools.ResolveError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
         try:
-            rslt = server.tree.eval_at(args)
+            rslt = server.cache(args)
         except abstree.EvalError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        server.tally(ctx.author, 'query')
+        i = server.queries.append(ctx.author.id, args, rslt)
+        self.bot.store.log(server, 'query', server.queries, i)
+        self.bot.outbox.post(ctx, f"Your query result is `{rslt}`.")
+    
+    @dm_only()
+    @command(aliases=["qb"], usage="(<argument_list>) (<argument_list>) ...", brief="Query several function values at once")
+    async def query_batch(self, ctx, *, kwaris: Optional[str]):
+        try:
+            server = ask(self.bot, ctx.author, ctx.prefix, kwaris, kind="query", task='', cmd=ctx.command)
+        except AskError as err:
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        points = []
+        rest = kwaris
+        try:
+            while rest:
+                args, rest = tools.resolve_call(rest, server.arity)
+                points.append(args)
+        except tools.ResolveError as err:
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        if len(points) > BATCH_MAX:
+            self.bot.outbox.post(ctx, TOO_MANY.format(count=len(points), max=BATCH_MAX))
             return
-        server.players.add(ctx.author)
-        entries = server.queries.setdefault(ctx.author.id, [])
-        entries.append({'args': args, 'result': rslt})
-        await ctx.send(f"Your query result is `{rslt}`.")
+        if not abstree.load_numpy():
+            rslts = []
+            for args in points:
+                try:
+                    rslts.append(server.cache(args))
+                except abstree.EvalError:
+                    rslts.append(None)
+        else:
+            values, bad = server.simple.eval_batch(points)
+            rslts = [None if wrong else value for value, wrong in zip(values.tolist(), bad.tolist())]
+        rows = []
+        for args, rslt in zip(points, rslts):
+            if rslt is None: # outside the domain, not charged, as for query
+                rows.append((tools.fmt_args(args), "undefined"))
+                continue
+            server.tally(ctx.author, 'query')
+            i = server.queries.append(ctx.author.id, args, rslt)
+            self.bot.store.log(server, 'query', server.queries, i)
+            rows.append((tools.fmt_args(args), str(rslt))) # as query prints it, rather than tabulate's 6 significant digits
+        self.bot.outbox.post(ctx, f"Your query results:\n```{tools.fmt_table(rows, ['Arguments', 'Result'], disable_numparse=True)}```")
     
     @dm_only()
     @command(usage="(<argument_list>) <guess_value>", brief="Guess a function value")
@@ -102,30 +149,30 @@ class Game(Cog):
         try:
             server = ask(self.bot, ctx.author, ctx.prefix, gazz, kind="guess", task='', cmd=ctx.command)
         except AskError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
         try:
             args, gval = tools.resolve_call(gazz, server.arity)
         except tools.ResolveError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
         if gval == '':
-            await ctx.send(PRVD.format(kind="guess value", task='', pfx=ctx.prefix, cmd=ctx.command))
+            self.bot.outbox.post(ctx, PRVD.format(kind="guess value", task='', pfx=ctx.prefix, cmd=ctx.command))
             return
-        if abstree.NUM_RE.fullmatch(gval) is None:
-            await ctx.send(INVLD_GV.format(gval=gval))
+        if not abstree.is_num(gval):
+            self.bot.outbox.post(ctx, INVLD_GV.format(gval=gval))
             return
         gval = float(gval)
         try:
-            rslt = server.tree.eval_at(args)
+            rslt = server.cache(args)
         except abstree.EvalError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
-        server.players.add(ctx.author)
         correct = abstree.is_approx(gval, rslt)
-        entries = server.guesses.setdefault(ctx.author.id, [])
-        entries.append({'args': args, 'value': gval, 'result': rslt, 'correct': correct})
-        await ctx.send(f"Your guess value of `{gval}` is {'correct!' if correct else 'wrong.'}")
+        server.tally(ctx.author, 'guess', correct)
+        i = server.guesses.append(ctx.author.id, args, rslt, gval, correct)
+        self.bot.store.log(server, 'guess', server.guesses, i)
+        self.bot.outbox.post(ctx, f"Your guess value of `{gval}` is {'correct!' if correct else 'wrong.'}")
     
     @dm_only()
     @command(usage="(<parameter_list>) <expression>", brief="Submit a function")
@@ -133,20 +180,71 @@ class Game(Cog):
         try:
             server = ask(self.bot, ctx.author, ctx.prefix, sbmxn, kind="function", task='', cmd=ctx.command)
         except AskError as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
             return
         try:
-            params, expr, tree = tools.resolve_func(sbmxn, server.arity)
+            params, expr, tree = tools.resolve_func(sbmxn, server.arity, intern=True)
         except (tools.ResolveError, abstree.ParseError) as err:
-            await ctx.send(err.msg)
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        game = server.tree
+        timed_out = False
+        try:
+            with METRICS.time('verify'):
+                correct = (not server.exact or tree.may_ident(game, server.arity)) and await verify(self.bot, tree, server)
+        except asyncio.TimeoutError: # charged as wrong, so checks too slow to finish cannot be sent for free
+            correct, timed_out = False, True
+        if server.tree is not game:
+            self.bot.outbox.post(ctx, ENDED)
             return
-        server.players.add(ctx.author)
-        correct = tree.is_ident(server.tree, server.arity)
-        entries = server.submxns.setdefault(ctx.author.id, [])
-        entries.append({'params': params, 'expr': expr, 'tree': tree, 'correct': correct})
+        server.tally(ctx.author, 'submit', correct)
+        i = server.submxns.append(ctx.author.id, correct=correct, extra=(params, expr, tree))
+        self.bot.store.log(server, 'submit', server.submxns, i)
         if correct:
             server.winners.add(ctx.author.id)
-        await ctx.send(f"Your submission is {'correct, you win the game!' if correct else 'wrong.'}")
+        if timed_out:
+            self.bot.outbox.post(ctx, TIMEOUT)
+            return
+        self.bot.outbox.post(ctx, f"Your submission is {'correct, you win the game!' if correct else 'wrong.'}")
+    
+    @command(aliases=["lb"], usage="<count>", brief="Show the top players in the current game")
+    async def leaderboard(self, ctx, count: Optional[int] = LB_COUNT):
+        try:
+            server, _ = playing(self.bot, ctx)
+        except AskError as err:
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        self.bot.outbox.post(ctx, f"```{tbl_lb(server, max(count, 1))}```")
+    
+    @command(brief="Show your rank in the current game")
+    async def rank(self, ctx):
+        try:
+            server, what = playing(self.bot, ctx)
+        except AskError as err:
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        if ctx.author.id not in server.points:
+            self.bot.outbox.post(ctx, NOT_PLYD.format(what=what))
+            return
+        self.bot.outbox.post(ctx, RANK.format(rank=server.rank(ctx.author.id), count=len(server.ranking), pts=server.points[ctx.author.id]))
+    
+    @dm_only()
+    @command(aliases=["past", "vp"], brief="View your past queries, guesses and submissions")
+    async def view_past(self, ctx):
+        try:
+            server, _ = playing(self.bot, ctx)
+        except AskError as err:
+            self.bot.outbox.post(ctx, err.msg)
+            return
+        queries, guesses, submxns = server.queries, server.guesses, server.submxns
+        # values as query and guess printed them, rather than tabulate's 6 significant digits
+        query_tbl = tools.fmt_table([(tools.fmt_args(queries.args_of(i)), str(queries.result[i])) for i in queries.of(ctx.author.id)[-VP_COUNT:]],
+            ["Arguments", "Result"], disable_numparse=True)
+        guess_tbl = tools.fmt_table([(tools.fmt_args(guesses.args_of(i)), str(guesses.value[i]), EMOJI['tick' if guesses.correct[i] else 'cross']) for i in guesses.of(ctx.author.id)[-VP_COUNT:]],
+            ["Arguments", "Value", ''], disable_numparse=True)
+        sbmxn_tbl = tools.fmt_table([(f"({', '.join(submxns.extra[i][0])}) {submxns.extra[i][1]}", EMOJI['tick' if submxns.correct[i] else 'cross']) for i in submxns.of(ctx.author.id)[-VP_COUNT:]],
+            ["Function", ''])
+        self.bot.outbox.post(ctx, VP_FMT.format(query_tbl=query_tbl, guess_tbl=guess_tbl, sbmxn_tbl=sbmxn_tbl))
     
 
 def ask(bot, author, pfx, qsn, **kwargs):
@@ -162,26 +260,28 @@ def ask(bot, author, pfx, qsn, **kwargs):
         raise AskError(PRVD.format(pfx=pfx, **kwargs))
     return server
 
-def tbl_lb(server):
+async def verify(bot, tree, server):
+    if bot.verifier is None:
+        return tree.has_poly(server.poly, server.arity, server.exact)
+    return await bot.verifier.verify(bot.verify_timeout, tree.dump(), server.poly, server.arity, server.exact)
+
+def playing(bot, ctx):
+    guild = ctx.guild or bot.choices.get(ctx.author.id)
+    if guild is None:
+        raise AskError(NOT_CHSN.format(pfx=ctx.prefix))
+    server = bot.servers[guild.id]
+    what = "this server" if ctx.guild else f"your chosen server {tools.fmt_guild(guild)}"
+    if server.arity == -1:
+        raise AskError(RUNNING.format(whether="no", what=what))
+    return server, what
+
+def tbl_lb(server, count=None):
     lb = []
-    for player in server.players:
-        nq = len(server.queries.get(player.id, []))
-        guesses = server.guesses.get(player.id, [])
-        ngc = sum(entry['correct'] for entry in guesses)
-        ngw = len(guesses) - ngc
-        submxns = server.submxns.get(player.id, [])
-        nsc = sum(entry['correct'] for entry in submxns)
-        nsw = len(submxns) - nsc
-        pts = (PTS['query'] * nq
-             + PTS['guess']['correct'] * ngc
-             + PTS['guess']['wrong'] * ngw
-             + PTS['submit']['correct'] * nsc
-             + PTS['submit']['wrong'] * nsw)
-        lb.append((player, nq, f"{ngc} {EMOJI['tick']} / {ngw} {EMOJI['cross']}", f"{nsc} {EMOJI['tick']} / {nsw} {EMOJI['cross']}", pts))
-    return tabulate(sorted(lb, key=lambda item: item[-1], reverse=True), ['', "Queries", "Guesses", "Submissions", "Points"], tools.TBL_FMT)
+    for neg_pts, player_id in server.ranking[:count]:
+        nq, ngc, ngw, nsc, nsw = server.scores[player_id]
+        lb.append((server.players[player_id], nq, f"{ngc} {EMOJI['tick']} / {ngw} {EMOJI['cross']}", f"{nsc} {EMOJI['tick']} / {nsw} {EMOJI['cross']}", -neg_pts))
+    return tools.fmt_table(lb, ['', "Queries", "Guesses", "Submissions", "Points"])
 
 def setup(bot):
-    from importlib import reload as reimport
-    reimport(abstree)
-    reimport(tools)
+    reloads.refresh(abstree, tools)
     bot.add_cog(Game(bot))
@@ -1,34 +1,93 @@
 import json
+from time import perf_counter
 from discord import Intents
-from discord.ext.commands import command, is_owner, Bot, DefaultHelpCommand
+from discord.ext.commands import command, is_owner, Bot, Context, DefaultHelpCommand
+from metrics import METRICS
+import abstree, tools, store
+from verifier import Verifier
+from outbox import Outbox
 
+@METRICS.timed_async('cmd_pfx')
 async def cmd_pfx(bot, msg):
-    guild = msg.guild or bot.choices.get(msg.author.id)
-    if guild:
-        return bot.servers[guild.id].prefix
-    return bot.dft_pfx
+    key = msg.guild.id if msg.guild else msg.author.id # snowflakes, so guild and user ids never collide
+    pfx = bot.prefixes.get(key)
+    if pfx is None:
+        guild = msg.guild or bot.choices.get(msg.author.id)
+        pfx = bot.prefixes[key] = bot.servers[guild.id].prefix if guild else bot.dft_pfx
+    return pfx
+
+async def start_clock(ctx):
+    ctx.clock = perf_counter() if METRICS.sampled() else None
+
+async def stop_clock(ctx):
+    if ctx.clock is not None:
+        METRICS.observe(f"command:{ctx.command.qualified_name}", perf_counter() - ctx.clock)
+
+class TimedContext(Context):
+    @METRICS.timed_async('send')
+    async def send(self, *args, **kwargs):
+        return await super().send(*args, **kwargs)
+    
 
 class IOBot(Bot):
-    def __init__(self, data):
+    def __init__(self, data, **options):
         intents = Intents.none()
         for reqd in data['intents']:
             setattr(intents, reqd, True)
-        super().__init__(cmd_pfx, DefaultHelpCommand(sort_commands=False), intents=intents)
+        super().__init__(cmd_pfx, DefaultHelpCommand(sort_commands=False), intents=intents, **options)
         self.dft_pfx = data['prefix']
+        self.servers = {} # guild.id: Server
         self.choices = {}
+        self.router = None # shard.Router, when running as one of several shard processes
+        self.prefixes = {} # guild.id or DM author.id: prefix, cleared whenever a prefix or choice changes
+        self.verifier = Verifier(data['workers']) if data['workers'] else None
+        self.verify_timeout = data['verify_timeout']
+        self.exact = data['exact'] # exact rational coefficients for submission checks, rather than float ones
+        self.store = store.open_store(data['store'])
+        self.outbox = Outbox() # replies are posted here rather than awaited in the commands
+        METRICS.enabled = data['metrics']['enabled']
+        METRICS.sample = data['metrics']['sample']
+        self.before_invoke(start_clock)
+        self.after_invoke(stop_clock)
+        self.loop.create_task(self.store.run())
         for xtsn in data['extensions']:
             self.load_extension(xtsn)
+        if not data['lazy']: # pay for the deferred imports now, rather than in the first command needing them
+            abstree.load_numpy()
+            tools.table_format()
+    
+    async def close(self):
+        if self.verifier:
+            self.verifier.close()
+        await self.outbox.flush()
+        await super().close()
+        self.store.close()
     
     async def on_ready(self):
-        self.servers = {guild.id: self.Server(self.dft_pfx) for guild in self.guilds}
+        # fired again after every reconnect, so only guilds without a server yet are set up and restored,
+        # leaving live games, and their writes still queued in the store, as they are
+        guilds = [guild for guild in self.guilds if guild.id not in self.servers]
+        for guild in guilds:
+            self.servers[guild.id] = self.Server(guild.id, self.dft_pfx)
+        self.store.restore(self, guilds)
+        self.prefixes.clear()
         await self.user.edit(username=f"IO Bot [{self.dft_pfx}]")
         print('ready')
     
+    async def get_context(self, msg, *, cls=TimedContext):
+        return await super().get_context(msg, cls=cls)
+    
+    async def on_message(self, msg):
+        if self.router and await self.router.forward(msg):
+            return
+        await self.process_commands(msg)
+    
     async def on_guild_join(self, guild):
-        self.servers[guild.id] = self.Server(self.dft_pfx)
+        self.servers[guild.id] = self.Server(guild.id, self.dft_pfx)
     
     async def on_guild_remove(self, guild):
         self.servers.pop(guild.id)
+        self.prefixes.clear()
     
 
 if __name__ == '__main__':
@@ -0,0 +1,143 @@
+import sys, json, random, asyncio, argparse
+from time import perf_counter
+from types import SimpleNamespace
+from io_bot import cmd_pfx
+from game_cog import Game
+from misc_cog import Misc
+from server import Server
+from outbox import Outbox
+from verifier import Verifier
+from metrics import METRICS
+from bench import PARAMS, rand_expr, commit
+import store
+
+MIX = {'query': 0.6, 'guess': 0.3, 'submit': 0.1} # share of each command after choose_server
+WIN_RATE = 0.05 # share of submissions that are the game function itself
+LAG_SECS = 0.01 # event loop lag sampling interval
+DRAIN_SECS = 60.0 # longest wait for replies still queued in the outbox once players stop
+
+class StubChannel: # DM channel whose sends complete at once, standing in for Discord behind the outbox
+    def __init__(self, id):
+        self.id = id
+        self.msgs = 0
+    
+    async def send(self, content=None, **kwargs):
+        self.msgs += 1
+    
+
+class StubCtx:
+    def __init__(self, author, cmd):
+        self.author = author
+        self.guild = None
+        self.channel = StubChannel(author.id)
+        self.prefix = '.'
+        self.command = cmd
+        self.message = SimpleNamespace(guild=None, author=author)
+    
+    async def send(self, content=None, **kwargs):
+        await self.channel.send(content, **kwargs)
+    
+
+def stub_bot(guild_count, workers, exact, path, rng):
+    bot = SimpleNamespace(dft_pfx='.', choices={}, prefixes={}, servers={}, router=None, exact=exact, verify_timeout=10,
+                          verifier=Verifier(workers) if workers else None, store=store.open_store(path), outbox=Outbox())
+    guilds = [SimpleNamespace(id=(i + 1) << 22, name=f"guild{i}") for i in range(guild_count)]
+    for guild in guilds:
+        arity = rng.randint(1, 3)
+        server = bot.servers[guild.id] = Server(guild.id, bot.dft_pfx)
+        server.start_game(f"({', '.join(PARAMS[:arity])}) {rand_expr(rng, arity, rng.randint(3, 12))}", exact)
+    return bot, guilds
+
+def rand_args(rng, arity):
+    return f"({', '.join(str(rng.randint(-9, 9)) for _ in range(arity))})"
+
+async def play(bot, cogs, author, guild, rate, deadline, rng, lats):
+    game, misc = cogs
+    cmds = {'choose_server': (misc, misc.choose_server), 'query': (game, game.query), 'guess': (game, game.guess), 'submit': (game, game.submit)}
+    kind, kwargs = 'choose_server', {'guild': guild}
+    while True:
+        cog, cmd = cmds[kind]
+        ctx = StubCtx(author, cmd)
+        start = perf_counter()
+        await cmd_pfx(bot, ctx.message)
+        await cmd.callback(cog, ctx, **kwargs)
+        lats.setdefault(kind, []).append(perf_counter() - start)
+        await asyncio.sleep(min(rng.expovariate(rate), max(0.0, deadline - perf_counter())))
+        if perf_counter() >= deadline:
+            return
+        server = bot.servers[guild.id]
+        kind = rng.choices(list(MIX), list(MIX.values()))[0]
+        if kind == 'query':
+            kwargs = {'kwari': rand_args(rng, server.arity)}
+        elif kind == 'guess':
+            kwargs = {'gazz': f"{rand_args(rng, server.arity)} {rng.randint(-9, 9)}"}
+        elif rng.random() < WIN_RATE:
+            kwargs = {'sbmxn': server.source}
+        else:
+            kwargs = {'sbmxn': f"({', '.join(PARAMS[:server.arity])}) {rand_expr(rng, server.arity, rng.randint(3, 12))}"}
+
+async def watch_lag(lags):
+    while True:
+        start = perf_counter()
+        await asyncio.sleep(LAG_SECS)
+        lags.append(perf_counter() - start - LAG_SECS)
+
+def pcts(samples): # milliseconds
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e3
+    return {'count': len(samples), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': samples[-1] * 1e3}
+
+async def run(players, guild_count, duration, rate, workers, exact, path, seed):
+    rng = random.Random(seed)
+    bot, guilds = stub_bot(guild_count, workers, exact, path, rng)
+    cogs = Game(bot), Misc(bot)
+    lats = {} # command name: latencies in seconds
+    lags = []
+    bot.outbox.waits = []
+    flusher = asyncio.get_running_loop().create_task(bot.store.run())
+    watcher = asyncio.get_running_loop().create_task(watch_lag(lags))
+    start = perf_counter()
+    deadline = start + duration
+    authors = [SimpleNamespace(id=(guild_count + i + 1) << 22, name=f"player{i}") for i in range(players)]
+    await asyncio.gather(*(play(bot, cogs, author, rng.choice(guilds), rate, deadline, random.Random(rng.random()), lats) for author in authors))
+    elapsed = perf_counter() - start
+    try: # replies wait behind the global rate limit, so their delivery can trail the handlers by far
+        await asyncio.wait_for(bot.outbox.flush(), DRAIN_SECS)
+    except asyncio.TimeoutError:
+        pass
+    for task in [flusher, watcher, *bot.outbox.workers.values()]:
+        task.cancel()
+    if bot.verifier:
+        bot.verifier.close()
+    bot.store.close()
+    total = sum(map(len, lats.values()))
+    return {'players': players, 'guilds': guild_count, 'duration_s': elapsed, 'commands': total, 'commands_per_s': total / elapsed,
+            'latency': {kind: pcts(samples) for kind, samples in sorted(lats.items())}, 'all': pcts([lat for samples in lats.values() for lat in samples]),
+            'loop_lag': pcts(lags), 'replies': {'posted': bot.outbox.posted, 'delivered': bot.outbox.delivered, 'undelivered': bot.outbox.posted - bot.outbox.delivered,
+            'messages_sent': bot.outbox.sent, 'delivery_latency': pcts(bot.outbox.waits)},
+            'metrics': [dict(zip(['name', 'count', 'p50_ms', 'p95_ms', 'p99_ms'], row)) for row in METRICS.rows()]}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline load test driving the game and misc cogs with simulated players.")
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--guilds', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds")
+    parser.add_argument('--rate', type=float, default=1.0, help="commands per second per player")
+    parser.add_argument('--workers', type=int, default=0, help="concurrent verification processes, 0 to verify on the event loop")
+    parser.add_argument('--exact', action='store_true', help="exact rational identity checks")
+    parser.add_argument('--store', default=None, help="SQLite path, to include write-behind persistence")
+    parser.add_argument('--metrics', action='store_true', help="also time the instrumented hot paths")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--out', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    METRICS.enabled = args.metrics
+    rslts = {'commit': commit(), 'python': sys.version.split()[0]}
+    rslts.update(asyncio.run(run(args.players, args.guilds, args.duration, args.rate, args.workers, args.exact, args.store, args.seed)))
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(rslts, file, indent=4)
+    else:
+        json.dump(rslts, sys.stdout, indent=4)
+        print()
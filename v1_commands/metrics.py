@@ -0,0 +1,114 @@
+from time import perf_counter
+from bisect import bisect_left
+from random import random
+from functools import wraps
+
+BUCKETS = [1e-6 * 2 ** i for i in range(28)] # upper bounds in seconds, 1us up to about 2 minutes
+QUANTILES = [0.5, 0.95, 0.99]
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, secs):
+        self.counts[bisect_left(BUCKETS, secs)] += 1
+        self.count += 1
+        self.sum += secs
+    
+    def quantile(self, q): # upper bound of the bucket holding the q-th observation
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + [float('inf')], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+    
+
+class Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        self.start = perf_counter()
+    
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, perf_counter() - self.start)
+    
+
+class NoTimer:
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, *exc):
+        pass
+    
+
+NO_TIMER = NoTimer()
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.sample = 1.0 # fraction of calls timed while enabled
+        self.hists = {} # name: Histogram
+    
+    def observe(self, name, secs):
+        hist = self.hists.get(name)
+        if hist is None:
+            hist = self.hists[name] = Histogram()
+        hist.observe(secs)
+    
+    def sampled(self):
+        return self.enabled and (self.sample >= 1 or random() < self.sample)
+    
+    def time(self, name):
+        return Timer(self, name) if self.sampled() else NO_TIMER
+    
+    def timed(self, name):
+        def deco(func):
+            @wraps(func)
+            def wrap(*args, **kwargs):
+                if not self.sampled():
+                    return func(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, perf_counter() - start)
+            return wrap
+        return deco
+    
+    def timed_async(self, name):
+        def deco(func):
+            @wraps(func)
+            async def wrap(*args, **kwargs):
+                if not self.sampled():
+                    return await func(*args, **kwargs)
+                start = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.observe(name, perf_counter() - start)
+            return wrap
+        return deco
+    
+    def rows(self):
+        return [(name, hist.count, *(hist.quantile(q) * 1e3 for q in QUANTILES)) for name, hist in sorted(self.hists.items())]
+    
+    def prometheus(self):
+        lines = ["# TYPE io_bot_latency_seconds histogram"]
+        for name, hist in sorted(self.hists.items()):
+            seen = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                seen += count
+                lines.append(f'io_bot_latency_seconds_bucket{{name="{name}",le="{bound:g}"}} {seen}')
+            lines.append(f'io_bot_latency_seconds_bucket{{name="{name}",le="+Inf"}} {hist.count}')
+            lines.append(f'io_bot_latency_seconds_sum{{name="{name}"}} {hist.sum}')
+            lines.append(f'io_bot_latency_seconds_count{{name="{name}"}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+    
+
+METRICS = Metrics()
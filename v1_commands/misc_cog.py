@@ -1,7 +1,9 @@
+from io import BytesIO
 from typing import Optional, Union, Literal
-from discord import Guild, TextChannel, Role
-from discord.ext.commands import command, check, dm_only, guild_only, Cog
-import tools
+from discord import Guild, TextChannel, Role, File
+from discord.ext.commands import command, check, dm_only, guild_only, is_owner, Cog
+from metrics import METRICS
+import tools, reloads
 
 CUR_SET = """The server {kind} is currently set to: `{cur}`.
 To change it, use `{pfx}{cmd.name} {cmd.usage}`."""
@@ -27,6 +29,9 @@ ROL_SET = """The server {kind} channel is currently set to: {role}.
 To change it, use `{pfx}{cmd.name} {cmd.usage}` with the channel ID/mention/name, or `none` to remove it."""
 ROL_NOT = """The server {kind} channel is currently not set.
 To set it, use `{pfx}{cmd.name} {cmd.usage}` with the channel ID/mention/name, or `none` to remove it."""
+METRICS_FMT = """Latency metrics (sampling {state}, {sample:.0%} of calls):
+```{tbl}```
+Evaluation caches: `{hits}` hit(s), `{misses}` miss(es) across `{games}` running game(s)."""
 
 class Misc(Cog):
     def __init__(self, bot):
@@ -37,42 +42,47 @@ class Misc(Cog):
     async def prefix(self, ctx, pfx: Optional[str]):
         server = self.bot.servers[ctx.guild.id]
         if pfx is None:
-            await ctx.send(CUR_SET.format(kind="prefix", cur=server.prefix, pfx=ctx.prefix, cmd=ctx.command))
+            self.bot.outbox.post(ctx, CUR_SET.format(kind="prefix", cur=server.prefix, pfx=ctx.prefix, cmd=ctx.command))
             return
         server.prefix = pfx
+        self.bot.prefixes.clear() # also cached for everyone who chose this server
+        self.bot.store.save(server)
         await ctx.guild.me.edit(nick=f"{server.nickname} [{pfx}]")
-        await ctx.send(NOW_SET.format(kind="prefix", now=f'`{pfx}`'))
+        self.bot.outbox.post(ctx, NOW_SET.format(kind="prefix", now=f'`{pfx}`'))
     
     @check(tools.has_ctrl)
     @command(aliases=["nick"], usage="<nickname>", brief="Set the bot nickname (excluding server prefix)")
     async def nickname(self, ctx, *, nick: Optional[str]):
         server = self.bot.servers[ctx.guild.id]
         if nick is None:
-            await ctx.send(CUR_SET.format(kind="bot nickname (excluding server prefix)", cur=server.nickname, pfx=ctx.prefix, cmd=ctx.command))
+            self.bot.outbox.post(ctx, CUR_SET.format(kind="bot nickname (excluding server prefix)", cur=server.nickname, pfx=ctx.prefix, cmd=ctx.command))
             return
         server.nickname = nick
+        self.bot.store.save(server)
         await ctx.guild.me.edit(nick=f"{nick} [{server.prefix}]")
-        await ctx.send(NOW_SET.format(kind="bot nickname", now=f'`{nick}`'))
+        self.bot.outbox.post(ctx, NOW_SET.format(kind="bot nickname", now=f'`{nick}`'))
     
     @command(aliases=["choose", "cs"], usage="<server>", brief="Choose a server to play in")
     async def choose_server(self, ctx, guild: Optional[Union[Guild, str]]):
         if guild is None:
             guild = self.bot.choices.get(ctx.author.id)
             if guild:
-                await ctx.send(CUR_SRV.format(guild=tools.fmt_guild(guild), pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, CUR_SRV.format(guild=tools.fmt_guild(guild), pfx=ctx.prefix, cmd=ctx.command))
             else:
-                await ctx.send(NOT_SRV.format(pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, NOT_SRV.format(pfx=ctx.prefix, cmd=ctx.command))
             return
         if guild == 'here':
             if ctx.guild is None:
-                await ctx.send(HERE.format(pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, HERE.format(pfx=ctx.prefix, cmd=ctx.command))
                 return
             guild = ctx.guild
         elif isinstance(guild, str):
-            await ctx.send(INVLD_SRV.format(nonguild=guild, pfx=ctx.prefix, cmd=ctx.command))
+            self.bot.outbox.post(ctx, INVLD_SRV.format(nonguild=guild, pfx=ctx.prefix, cmd=ctx.command))
             return
         self.bot.choices[ctx.author.id] = guild
-        await ctx.send(NOW_SRV.format(guild=tools.fmt_guild(guild)))
+        self.bot.prefixes.pop(ctx.author.id, None)
+        self.bot.store.choose(ctx.author.id, guild.id)
+        self.bot.outbox.post(ctx, NOW_SRV.format(guild=tools.fmt_guild(guild)))
     
     @check(tools.has_ctrl)
     @command(aliases=["anc_chnl", "ac"], usage="<channel>", brief="Set the channel for game announcements")
@@ -80,17 +90,18 @@ class Misc(Cog):
         server = self.bot.servers[ctx.guild.id]
         if chnl is None:
             if server.anc_chnl:
-                await ctx.send(CH_SET.format(kind="announcement", chnl=server.anc_chnl, pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, CH_SET.format(kind="announcement", chnl=server.anc_chnl, pfx=ctx.prefix, cmd=ctx.command))
             else:
-                await ctx.send(CH_NOT.format(kind="announcement", pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, CH_NOT.format(kind="announcement", pfx=ctx.prefix, cmd=ctx.command))
             return
         if chnl == 'here':
             chnl = ctx.channel
         elif isinstance(chnl, str):
-            await ctx.send(INVALID.format(kind="announcement channel", thing=chnl))
+            self.bot.outbox.post(ctx, INVALID.format(kind="announcement channel", thing=chnl))
             return
         server.anc_chnl = chnl
-        await ctx.send(NOW_SET.format(kind="announcement channel", now=chnl.mention))
+        self.bot.store.save(server)
+        self.bot.outbox.post(ctx, NOW_SET.format(kind="announcement channel", now=chnl.mention))
     
     @check(tools.has_ctrl)
     @command(aliases=["ctrl_role", "cr"], usage="<role>", brief="Set the role to control games")
@@ -98,18 +109,20 @@ class Misc(Cog):
         server = self.bot.servers[ctx.guild.id]
         if role is None:
             if server.ctrl_role:
-                await ctx.send(ROL_SET.format(role=tools.fmt_role(server.ctrl_role), pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, ROL_SET.format(role=tools.fmt_role(server.ctrl_role), pfx=ctx.prefix, cmd=ctx.command))
             else:
-                await ctx.send(ROL_NOT.format(pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, ROL_NOT.format(pfx=ctx.prefix, cmd=ctx.command))
             return
         if isinstance(role, Role):
             server.ctrl_role = role
-            await ctx.send(NOW_SET.format(kind="controller role", now=tools.fmt_role(role)))
+            self.bot.store.save(server)
+            self.bot.outbox.post(ctx, NOW_SET.format(kind="controller role", now=tools.fmt_role(role)))
         elif role == 'none':
             server.ctrl_role = None
-            await ctx.send(NOW_RMV.format(kind="controller role"))
+            self.bot.store.save(server)
+            self.bot.outbox.post(ctx, NOW_RMV.format(kind="controller role"))
         else: # str
-            await ctx.send(INVALID.format(kind="controller role", thing=tools.fmt_role(role)))
+            self.bot.outbox.post(ctx, INVALID.format(kind="controller role", thing=tools.fmt_role(role)))
     
     @check(tools.has_ctrl)
     @command(aliases=["ptcp_role", "pr"], usage="<role>", brief="Set the role to ping participants")
@@ -117,21 +130,41 @@ class Misc(Cog):
         server = self.bot.servers[ctx.guild.id]
         if role is None:
             if server.ptcp_role:
-                await ctx.send(CUR_PTCP.format(role=tools.fmt_role(server.ptcp_role), pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, CUR_PTCP.format(role=tools.fmt_role(server.ptcp_role), pfx=ctx.prefix, cmd=ctx.command))
             else:
-                await ctx.send(NOT_PTCP.format(pfx=ctx.prefix, cmd=ctx.command))
+                self.bot.outbox.post(ctx, NOT_PTCP.format(pfx=ctx.prefix, cmd=ctx.command))
             return
         if isinstance(role, Role):
             server.ptcp_role = role
-            await ctx.send(NOW_SET.format(kind="participant role", now=tools.fmt_role(role)))
+            self.bot.store.save(server)
+            self.bot.outbox.post(ctx, NOW_SET.format(kind="participant role", now=tools.fmt_role(role)))
         elif role == 'none':
             server.ptcp_role = None
-            await ctx.send(NOW_RMV.format(kind="participant role"))
+            self.bot.store.save(server)
+            self.bot.outbox.post(ctx, NOW_RMV.format(kind="participant role"))
         else: # str
-            await ctx.send(INVALID.format(kind="participant role", thing=tools.fmt_role(role)))
+            self.bot.outbox.post(ctx, INVALID.format(kind="participant role", thing=tools.fmt_role(role)))
+    
+    @is_owner()
+    @command(usage="<on|off|reset|prometheus>", brief="Show command latency metrics")
+    async def metrics(self, ctx, mode: Optional[Literal['on', 'off', 'reset', 'prometheus']]):
+        caches = {guild_id: server.cache for guild_id, server in self.bot.servers.items() if server.cache}
+        if mode == 'prometheus':
+            text = METRICS.prometheus()
+            for kind in ['hits', 'misses']:
+                text += f"# TYPE io_bot_eval_cache_{kind} counter\n"
+                text += ''.join(f'io_bot_eval_cache_{kind}{{guild="{guild_id}"}} {getattr(cache, kind)}\n' for guild_id, cache in caches.items())
+            self.bot.outbox.post(ctx, file=File(BytesIO(text.encode()), "metrics.prom"))
+            return
+        if mode in ['on', 'off']:
+            METRICS.enabled = mode == 'on'
+        elif mode == 'reset':
+            METRICS.hists.clear()
+        tbl = tools.fmt_table(METRICS.rows(), ['', "Count", "p50 (ms)", "p95 (ms)", "p99 (ms)"], floatfmt='.3f')
+        self.bot.outbox.post(ctx, METRICS_FMT.format(state="on" if METRICS.enabled else "off", sample=METRICS.sample, tbl=tbl,
+            hits=sum(cache.hits for cache in caches.values()), misses=sum(cache.misses for cache in caches.values()), games=len(caches)))
     
 
 def setup(bot):
-    from importlib import reload as reimport
-    reimport(tools)
+    reloads.refresh(tools)
     bot.add_cog(Misc(bot))
@@ -0,0 +1,88 @@
+import asyncio
+from collections import deque
+from time import monotonic
+from traceback import print_exc
+
+MSG_LIMIT = 2000
+CHNL_RATE = (5, 5.0) # sends per seconds, per channel
+GLOBAL_RATE = (50, 1.0) # sends per seconds, across all channels
+
+class Bucket: # token bucket, refilled continuously up to rate tokens every per seconds
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.stamp = monotonic()
+    
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.stamp) * self.rate / self.per)
+        self.stamp = now
+    
+    def full(self):
+        self.refill()
+        return self.tokens >= self.rate
+    
+    def delay(self): # takes a token now, returning how long to wait until it is really there
+        self.refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens * self.per / self.rate)
+    
+
+class Outbox:
+    # replies are queued per channel and sent in order by one task each, so handlers need not wait on them
+    # text queued while a channel waits on its bucket is merged into as few messages as fit under MSG_LIMIT
+    def __init__(self, chnl_rate=CHNL_RATE, global_rate=GLOBAL_RATE):
+        self.chnl_rate = chnl_rate
+        self.glob = Bucket(*global_rate)
+        self.queues = {} # channel.id: deque of (content, kwargs, monotonic time posted)
+        self.buckets = {} # channel.id: Bucket, kept until it is full again
+        self.workers = {} # channel.id: task draining its queue
+        self.posted = 0
+        self.sent = 0 # messages, each of one or more merged replies
+        self.delivered = 0 # replies
+        self.waits = None # list taking each delivered reply's seconds from post to send, if set
+    
+    def post(self, dest, content=None, **kwargs): # dest is a Context or a channel
+        key = getattr(dest, 'channel', dest).id
+        self.queues.setdefault(key, deque()).append((content, kwargs, monotonic()))
+        self.posted += 1
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_running_loop().create_task(self.drain(key, dest))
+    
+    async def drain(self, key, dest):
+        queue = self.queues[key]
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(*self.chnl_rate)
+        try:
+            while queue:
+                await asyncio.sleep(max(bucket.delay(), self.glob.delay()))
+                content, kwargs, stamp = queue.popleft()
+                stamps = [stamp]
+                if not kwargs: # attachments and embeds go alone
+                    while queue and not queue[0][1] and len(content) + 1 + len(queue[0][0]) <= MSG_LIMIT:
+                        more, _, stamp = queue.popleft()
+                        content += '\n' + more
+                        stamps.append(stamp)
+                try:
+                    await dest.send(content, **kwargs)
+                    self.delivered += len(stamps)
+                    if self.waits is not None:
+                        now = monotonic()
+                        self.waits.extend(now - stamp for stamp in stamps)
+                except Exception: # one failed reply must not stall the rest of the channel's queue
+                    print_exc()
+                self.sent += 1
+        finally:
+            del self.workers[key]
+            del self.queues[key]
+            asyncio.get_running_loop().call_later(bucket.per, self.expire, key)
+    
+    def expire(self, key):
+        bucket = self.buckets.get(key)
+        if bucket and key not in self.workers and bucket.full():
+            del self.buckets[key]
+    
+    async def flush(self):
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
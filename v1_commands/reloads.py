@@ -0,0 +1,15 @@
+import os
+from importlib import reload
+
+stamps = {} # module name: source mtime when it was last (re)loaded
+
+def refresh(*modules):
+    # modules in dependency order: each is reloaded only if its source changed, or one before it was reloaded
+    # the first check just records the mtime, as the module was imported moments before by the extension itself
+    stale = False
+    for module in modules:
+        mtime = os.stat(module.__file__).st_mtime_ns
+        stale = stale or stamps.setdefault(module.__name__, mtime) != mtime
+        if stale:
+            reload(module)
+            stamps[module.__name__] = mtime
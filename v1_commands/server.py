@@ -1,23 +1,119 @@
 
+from bisect import bisect_left, insort
+from array import array
+from math import nan
+from time import time
+import tools
+
+PTS = {'query': 1, 'guess': {'correct': 0, 'wrong': 2}, 'submit': {'correct': 0, 'wrong': 1}}
+SLOTS = [('query', None), ('guess', True), ('guess', False), ('submit', True), ('submit', False)] # (kind, correct) of each tally
+SLOT_PTS = [PTS['query'], PTS['guess']['correct'], PTS['guess']['wrong'], PTS['submit']['correct'], PTS['submit']['wrong']]
+
+class EventLog: # one typed column per field, event i of the game is row i
+    def __init__(self):
+        self.author = array('Q')
+        self.time = array('d')
+        self.offset = array('Q', [0]) # args of event i are args[offset[i]:offset[i + 1]]
+        self.args = array('d')
+        self.value = array('d')
+        self.result = array('d')
+        self.correct = array('b')
+        self.extra = [] # per-event objects, if any
+        self.by_author = {} # author.id: array of event indices
+    
+    def __len__(self):
+        return len(self.author)
+    
+    def append(self, author_id, args=(), result=nan, value=nan, correct=False, extra=None, when=None):
+        i = len(self.author)
+        self.author.append(author_id)
+        self.time.append(time() if when is None else when)
+        self.args.extend(args)
+        self.offset.append(len(self.args))
+        self.value.append(value)
+        self.result.append(result)
+        self.correct.append(correct)
+        if extra is not None:
+            self.extra.append(extra)
+        self.by_author.setdefault(author_id, array('Q')).append(i)
+        return i
+    
+    def of(self, author_id):
+        return self.by_author.get(author_id, ())
+    
+    def args_of(self, i):
+        return self.args[self.offset[i]:self.offset[i + 1]]
+    
+    def entry(self, i):
+        entry = {'time': self.time[i], 'args': list(self.args_of(i)), 'value': self.value[i], 'result': self.result[i], 'correct': bool(self.correct[i])}
+        if self.extra:
+            entry['params'], entry['expr'], _ = self.extra[i]
+        return entry
+    
+
 class Server:
-    def __init__(self, dft_pfx):
+    def __init__(self, guild_id, dft_pfx):
+        self.guild_id = guild_id
         self.prefix = dft_pfx
         self.nickname = "IO Bot"
         self.anc_chnl = None
         self.ctrl_role = None
         self.ptcp_role = None
-        
+        self.reset_game()
+    
+    def reset_game(self):
         self.arity = -1
+        self.source = None # function as given to begin_game
         self.tree = None
+        self.simple = None # simplified tree, which func and query_batch evaluate
+        self.func = None
+        self.poly = None # (numerator, denominator) of tree
+        self.exact = False # whether poly has exact integer coefficients
+        self.cache = None # tools.EvalCache of func
         
-        self.players = set() # author
-        self.queries = {} # author.id: [{args: , result: }]
-        self.guesses = {} # author.id: [{args: , value: , result: , correct: }]
-        self.submxns = {} # author.id: [{params: , tree: , correct: }]
+        self.players = {} # author.id: author
+        self.scores = {} # author.id: [count for each of SLOTS]
+        self.points = {} # author.id: points
+        self.ranking = [] # sorted (-points, author.id)
+        self.queries = EventLog() # args, result
+        self.guesses = EventLog() # args, value, result, correct
+        self.submxns = EventLog() # correct, extra: (params, expr, tree)
         self.winners = set() # author.id
     
+    def tally(self, author, kind, correct=None):
+        self.players[author.id] = author
+        if author.id in self.scores:
+            pts = self.points[author.id]
+            del self.ranking[bisect_left(self.ranking, (-pts, author.id))]
+        else:
+            self.scores[author.id] = [0] * len(SLOTS)
+            pts = 0
+        slot = SLOTS.index((kind, correct))
+        self.scores[author.id][slot] += 1
+        self.points[author.id] = pts = pts + SLOT_PTS[slot]
+        insort(self.ranking, (-pts, author.id))
+    
+    def rank(self, author_id): # 1 + number of players with more points
+        return bisect_left(self.ranking, (-self.points[author_id],)) + 1
+    
+    def start_game(self, source, exact=False):
+        params, _, self.tree = tools.resolve_func(source, intern=True)
+        self.source = source
+        self.arity = len(params)
+        self.simple = self.tree.simplify() # tree itself stays as given, for exact identity checks
+        self.func = self.simple.to_func()
+        self.cache = tools.EvalCache(self.func)
+        self.exact = exact
+        try:
+            self.poly = self.tree.to_ratpoly(self.arity) if exact else self.tree.to_poly(self.arity)
+        except ValueError: # non-finite literal, which only float coefficients can hold
+            self.exact = False
+            self.poly = self.tree.to_poly(self.arity)
+    
 
 def setup(bot):
     bot.Server = Server
-    if bot.is_ready():
-        bot.servers = {guild.id: Server(bot.dft_pfx) for guild in bot.guilds}
+    if bot.is_ready(): # reloaded, so live games keep their servers, and the Server code they started with
+        for guild in bot.guilds:
+            if guild.id not in bot.servers:
+                bot.servers[guild.id] = Server(guild.id, bot.dft_pfx)
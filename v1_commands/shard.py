@@ -0,0 +1,105 @@
+import os, json, shutil, sqlite3, asyncio, tempfile
+from multiprocessing import Process
+from io_bot import IOBot
+
+SOCK = "shard{}.sock" # in a private directory made for each run, so no other local user can connect
+shard_of = lambda guild_id, count: (guild_id >> 22) % count # as Discord assigns guilds to shards
+
+class SharedChoices: # bot.choices backed by the store's choices table, which every shard process shares
+    def __init__(self, bot, path):
+        self.bot = bot
+        self.cache = {} # author.id: chosen guild.id or None, dropped when any shard's router is told to forget the author
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS choices (author INTEGER PRIMARY KEY, guild INTEGER)")
+    
+    def guild_id(self, author_id):
+        if author_id not in self.cache:
+            row = self.db.execute("SELECT guild FROM choices WHERE author = ?", (author_id,)).fetchone()
+            self.cache[author_id] = row and row[0]
+        return self.cache[author_id]
+    
+    def get(self, author_id, default=None):
+        guild_id = self.guild_id(author_id)
+        return (guild_id and self.bot.get_guild(guild_id)) or default
+    
+    def update(self, choices): # nothing to restore, the table is already the shared state
+        pass
+    
+    def forget(self, author_id):
+        self.cache.pop(author_id, None)
+    
+    def __setitem__(self, author_id, guild):
+        self.db.execute("INSERT OR REPLACE INTO choices VALUES (?, ?)", (author_id, guild.id))
+        self.cache[author_id] = guild.id
+        self.bot.loop.create_task(self.bot.router.forget(author_id))
+    
+
+class Router: # forwards DMs to the shard owning the sender's chosen server, over one Unix socket per shard
+    def __init__(self, bot, shard_id, count, sock_dir):
+        self.bot = bot
+        self.shard_id = shard_id
+        self.count = count
+        self.sock_dir = sock_dir
+    
+    async def start(self):
+        path = os.path.join(self.sock_dir, SOCK.format(self.shard_id))
+        if os.path.exists(path):
+            os.remove(path)
+        await asyncio.start_unix_server(self.handle, path)
+    
+    async def handle(self, reader, writer):
+        req = json.loads(await reader.readline())
+        writer.close()
+        if req['kind'] == 'forget':
+            self.bot.choices.forget(req['author'])
+            self.bot.prefixes.pop(req['author'], None)
+        elif req['kind'] == 'message':
+            await self.bot.wait_until_ready()
+            chnl = self.bot.get_channel(req['channel']) or await self.bot.fetch_channel(req['channel'])
+            await self.bot.process_commands(await chnl.fetch_message(req['message']))
+    
+    async def send(self, shard_id, req):
+        try:
+            _, writer = await asyncio.open_unix_connection(os.path.join(self.sock_dir, SOCK.format(shard_id)))
+        except OSError: # shard not up (yet)
+            return False
+        writer.write(json.dumps(req).encode() + b'\n')
+        await writer.drain()
+        writer.close()
+        return True
+    
+    async def forget(self, author_id):
+        for shard_id in range(self.count):
+            if shard_id != self.shard_id:
+                await self.send(shard_id, {'kind': 'forget', 'author': author_id})
+    
+    async def forward(self, msg):
+        if msg.guild or msg.author.bot:
+            return False
+        guild_id = self.bot.choices.guild_id(msg.author.id)
+        if guild_id is None or shard_of(guild_id, self.count) == self.shard_id:
+            return False
+        return await self.send(shard_of(guild_id, self.count), {'kind': 'message', 'channel': msg.channel.id, 'message': msg.id})
+    
+
+def run_shard(shard_id, count, data, token, sock_dir):
+    bot = IOBot(data, shard_id=shard_id, shard_count=count)
+    bot.choices = SharedChoices(bot, data['store'])
+    bot.store.own_choices = False
+    bot.router = Router(bot, shard_id, count, sock_dir)
+    bot.loop.create_task(bot.router.start())
+    bot.run(token)
+
+if __name__ == '__main__':
+    with open("data.json", 'r') as file:
+        data = json.load(file)
+    if data['shards'] > 1 and not data['store']: # each process would otherwise open its own private temporary database
+        raise ValueError("Running several shards needs a store path, where their server choices are shared.")
+    sock_dir = tempfile.mkdtemp(prefix="io_bot_") # mode 0700
+    procs = [Process(target=run_shard, args=(shard_id, data['shards'], data, os.environ['IO_BOT_TOKEN'], sock_dir)) for shard_id in range(data['shards'])]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    shutil.rmtree(sock_dir, ignore_errors=True)
@@ -0,0 +1,140 @@
+import json, sqlite3, asyncio, threading
+from traceback import print_exc
+import tools
+
+FLUSH_SECS = 1.0
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS servers (guild INTEGER PRIMARY KEY, prefix TEXT, nickname TEXT, anc_chnl INTEGER, ctrl_role INTEGER, ptcp_role INTEGER, source TEXT);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY, guild INTEGER, kind TEXT, author INTEGER, entry TEXT);
+CREATE TABLE IF NOT EXISTS choices (author INTEGER PRIMARY KEY, guild INTEGER);
+CREATE TABLE IF NOT EXISTS players (guild INTEGER, author INTEGER, name TEXT, PRIMARY KEY (guild, author));
+CREATE INDEX IF NOT EXISTS events_guild ON events (guild);
+"""
+
+get_id = lambda thing: thing.id if thing else None
+
+class Player: # restored player no longer in the member cache, shown by the name they last played under
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+    
+    def __str__(self):
+        return self.name
+    
+
+class Store: # no persistence, every game is lost on restart
+    def save(self, server):
+        pass
+    
+    def log(self, server, kind, events, i):
+        pass
+    
+    def end_game(self, server):
+        pass
+    
+    def choose(self, author_id, guild_id):
+        pass
+    
+    def restore(self, bot, guilds):
+        pass
+    
+    async def run(self):
+        pass
+    
+    def close(self):
+        pass
+    
+
+class SqliteStore(Store):
+    # mutations are only queued here, and written in one transaction every FLUSH_SECS off the event loop
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.rows = {} # guild.id: latest servers row
+        self.names = {} # (guild.id, author.id): latest name shown in the leaderboard
+        self.ops = [] # (sql, params, (server.EventLog, index) of the entry to serialise or None), in order
+        self.own_choices = True # whether choose writes the choices table, off when shard.SharedChoices writes it itself
+        self.lock = threading.Lock()
+    
+    def save(self, server):
+        self.rows[server.guild_id] = (server.guild_id, server.prefix, server.nickname,
+            get_id(server.anc_chnl), get_id(server.ctrl_role), get_id(server.ptcp_role), server.source)
+    
+    def log(self, server, kind, events, i):
+        self.ops.append(("INSERT INTO events (guild, kind, author, entry) VALUES (?, ?, ?, ?)", (server.guild_id, kind, events.author[i]), (events, i)))
+        self.names[server.guild_id, events.author[i]] = str(server.players[events.author[i]])
+    
+    def end_game(self, server):
+        self.ops.append(("DELETE FROM events WHERE guild = ?", (server.guild_id,), None))
+        self.ops.append(("DELETE FROM players WHERE guild = ?", (server.guild_id,), None))
+        self.names = {key: name for key, name in self.names.items() if key[0] != server.guild_id}
+        self.save(server)
+    
+    def choose(self, author_id, guild_id):
+        if not self.own_choices: # a late second write could undo a newer choice made on another shard
+            return
+        self.ops.append(("INSERT OR REPLACE INTO choices VALUES (?, ?)", (author_id, guild_id), None))
+    
+    def flush(self):
+        rows, self.rows = self.rows, {}
+        ops, self.ops = self.ops, []
+        names, self.names = self.names, {}
+        if not rows and not ops and not names:
+            return
+        with self.lock, self.db:
+            for sql, params, event in ops:
+                if event is not None: # serialised here rather than in the command
+                    events, i = event
+                    params = *params, json.dumps(events.entry(i))
+                self.db.execute(sql, params)
+            self.db.executemany("INSERT OR REPLACE INTO servers VALUES (?, ?, ?, ?, ?, ?, ?)", rows.values())
+            self.db.executemany("INSERT OR REPLACE INTO players VALUES (?, ?, ?)", (key + (name,) for key, name in names.items()))
+    
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(FLUSH_SECS)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception: # the failed batch is rolled back and dropped, but later ones must still be written
+                print_exc()
+    
+    def close(self):
+        self.flush()
+        self.db.close()
+    
+    def restore(self, bot, guilds): # only these guilds, whose servers are new and so have nothing still queued
+        guilds = {guild.id: guild for guild in guilds}
+        choices = ((author_id, guilds.get(guild_id)) for author_id, guild_id in self.db.execute("SELECT author, guild FROM choices"))
+        bot.choices.update((author_id, guild) for author_id, guild in choices if guild)
+        for guild_id, prefix, nickname, anc_chnl, ctrl_role, ptcp_role, source in self.db.execute("SELECT * FROM servers"):
+            guild = guilds.get(guild_id)
+            if guild is None:
+                continue
+            server = bot.servers[guild_id]
+            server.prefix = prefix
+            server.nickname = nickname
+            server.anc_chnl = anc_chnl and guild.get_channel(anc_chnl)
+            server.ctrl_role = ctrl_role and guild.get_role(ctrl_role)
+            server.ptcp_role = ptcp_role and guild.get_role(ptcp_role)
+            if source is None:
+                continue
+            server.start_game(source, bot.exact)
+            names = dict(self.db.execute("SELECT author, name FROM players WHERE guild = ?", (guild_id,)))
+            for kind, author_id, entry in self.db.execute("SELECT kind, author, entry FROM events WHERE guild = ? ORDER BY id", (guild_id,)):
+                entry = json.loads(entry)
+                extra = None
+                if kind == 'submit':
+                    _, _, tree = tools.resolve_func(f"({', '.join(entry['params'])}) {entry['expr']}", server.arity, intern=True)
+                    extra = entry['params'], entry['expr'], tree
+                    if entry['correct']:
+                        server.winners.add(author_id)
+                events = {'query': server.queries, 'guess': server.guesses, 'submit': server.submxns}[kind]
+                events.append(author_id, entry['args'], entry['result'], entry['value'], entry['correct'], extra, entry['time'])
+                server.tally(guild.get_member(author_id) or Player(author_id, names.get(author_id, str(author_id))), kind, None if kind == 'query' else entry['correct'])
+    
+
+def open_store(path):
+    return SqliteStore(path) if path else Store()
@@ -0,0 +1,88 @@
+import random
+from fractions import Fraction
+import pytest
+from abstree import AST, EvalError
+from bench import PARAMS
+
+LITS = ['0', '1', '2', '4', '0.5', '-1'] # folding these as simplify does, never dividing one by another, is exact
+
+def rand_expr(rng, arity, size):
+    # as bench.rand_expr, but no operation takes two literals, so every folded constant is exact
+    if size <= 1:
+        return rng.choice(LITS) if rng.random() < 0.3 else PARAMS[rng.randrange(arity)]
+    left = rng.randint(1, size - 1)
+    lhs, rhs = rand_expr(rng, arity, left), rand_expr(rng, arity, size - left)
+    if lhs in LITS and rhs in LITS:
+        rhs = PARAMS[rng.randrange(arity)]
+    expr = f"({lhs}) {rng.choice('+-*/')} ({rhs})"
+    return f"-({expr})" if rng.random() < 0.1 else expr
+
+def exact_at(tree, point): # value in exact arithmetic, None outside the domain
+    vals = {}
+    for node in tree.postorder():
+        if node.oper == 'num':
+            val = Fraction(node.value)
+        elif node.oper == 'var':
+            val = Fraction(point[node.value])
+        elif node.oper == 'neg':
+            val = -vals[id(node.value)]
+        else:
+            val = vals[id(node.value[0])]
+            for op, arg in zip(node.oper, node.value[1:]):
+                arg = vals[id(arg)]
+                if op == '/' and arg == 0:
+                    return None
+                val = val + arg if op == '+' else val - arg if op == '-' else val * arg if op == '*' else val / arg
+        vals[id(node)] = val
+    return vals[id(tree)]
+
+def parse(source, intern=True):
+    params, expr = source[1:].split(') ', 1)
+    return AST.from_expr({param: i for i, param in enumerate(params.split(', '))}, expr, intern)
+
+@pytest.mark.parametrize('intern', [False, True])
+def test_simplify_exact_function_and_domain(intern):
+    rng = random.Random(0)
+    for _ in range(2000):
+        arity = rng.randint(1, 3)
+        tree = AST.from_expr({param: i for i, param in enumerate(PARAMS[:arity])}, rand_expr(rng, arity, rng.randint(2, 24)), intern)
+        simple = tree.simplify()
+        for _ in range(5):
+            point = [rng.choice([0, 1, -1, 2, 0.5, -3]) for _ in range(arity)]
+            assert exact_at(simple, point) == exact_at(tree, point), (tree.dump(), point)
+
+def test_simplify_zero_divisor_by_rounding():
+    # A = (x*y)*z - x*(y*z) is identically zero, so A*A - A/A is outside the domain everywhere in exact arithmetic, as is its simplified form;
+    # in floating point the original rounds A to a tiny nonzero value here, while both of its chains flatten to the same x*y*z
+    zero = "((x*y)*z - x*(y*z))"
+    tree = parse(f"(x, y, z) {zero}*{zero} - {zero}/{zero}")
+    simple = tree.simplify()
+    point = [0.1, 0.2, 0.3]
+    assert exact_at(tree, point) is None and exact_at(simple, point) is None
+    assert tree.eval_at(point) == pytest.approx(-1)
+    with pytest.raises(EvalError):
+        simple.eval_at(point)
+
+def test_simplify_reassociation_rounding():
+    # flattening the right chain reassociates, so the float values differ, but only by rounding of the same exact value
+    tree = parse("(x, y, z) x + (y + z)")
+    simple = tree.simplify()
+    point = [0.1, 0.2, 0.3]
+    assert simple.oper == '++'
+    assert exact_at(tree, point) == exact_at(simple, point)
+    assert tree.eval_at(point) != simple.eval_at(point)
+
+def test_simplify_folds_constants_in_floats():
+    simple = parse("(x) (0.1 + 0.2) + x").simplify()
+    assert simple.value[0].value == 0.1 + 0.2 != 0.3
+
+@pytest.mark.parametrize('op', ['+', '-', '*', '/'])
+def test_simplify_long_chains(op):
+    count = 20000
+    simple = parse(f"(x, y) {op.join(['x', 'y'] * (count // 2))}").simplify()
+    if op == '/': # the parser nests / to the right, and right chains under / are never flattened
+        assert len(simple.value) == 2
+    else:
+        assert len(simple.value) == count
+    simple = parse(f"(x) {'(' * count}x{'+1)' * count}").simplify()
+    assert simple.oper == '+' * count
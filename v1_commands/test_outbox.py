@@ -0,0 +1,54 @@
+import asyncio
+from outbox import Outbox, MSG_LIMIT
+
+FAST = (1000, 1.0) # rate limits that never hold a send back in these tests
+
+class Channel: # local transport, recording each send
+    def __init__(self, id, fail=0):
+        self.id = id
+        self.fail = fail # number of first sends to fail
+        self.msgs = []
+    
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(0)
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("send failed")
+        self.msgs.append((content, kwargs))
+    
+
+def deliver(posts, chnl_rate=FAST, global_rate=FAST):
+    async def run():
+        outbox = Outbox(chnl_rate, global_rate)
+        for chnl, content, kwargs in posts:
+            outbox.post(chnl, content, **kwargs)
+            await asyncio.sleep(0)
+        await outbox.flush()
+        return outbox
+    return asyncio.run(run())
+
+def test_order_per_channel():
+    chnls = [Channel(i) for i in range(3)]
+    deliver([(chnl, f"{chnl.id}:{i}", {}) for i in range(20) for chnl in chnls], chnl_rate=(1, 0.001))
+    for chnl in chnls:
+        assert '\n'.join(content for content, _ in chnl.msgs).split('\n') == [f"{chnl.id}:{i}" for i in range(20)]
+
+def test_merges_under_limit():
+    chnl = Channel(0)
+    outbox = deliver([(chnl, "x" * 600, {}) for _ in range(10)], chnl_rate=(1, 0.05))
+    assert all(len(content) <= MSG_LIMIT for content, _ in chnl.msgs)
+    assert 1 < len(chnl.msgs) < 10
+    assert ''.join(content for content, _ in chnl.msgs).replace('\n', '') == "x" * 6000
+    assert outbox.posted == outbox.delivered == 10 and outbox.sent == len(chnl.msgs)
+
+def test_attachments_alone():
+    chnl = Channel(0)
+    deliver([(chnl, "a", {}), (chnl, None, {'file': "f"}), (chnl, "b", {}), (chnl, "c", {})], chnl_rate=(1, 0.05))
+    assert chnl.msgs == [("a", {}), (None, {'file': "f"}), ("b\nc", {})]
+
+def test_failed_send_does_not_stall():
+    chnl = Channel(0, fail=1)
+    outbox = deliver([(chnl, "a", {}), (chnl, None, {'file': "f"}), (chnl, "b", {})], chnl_rate=(1, 0.01))
+    assert chnl.msgs == [(None, {'file': "f"}), ("b", {})]
+    assert not outbox.workers and not outbox.queues
+    assert outbox.sent == 3 and outbox.delivered == 2
@@ -1,8 +1,8 @@
-import re
-from tabulate import TableFormat, Line, DataRow
-from abstree import AST, NUM_RE, IDTF_RE
+from collections import OrderedDict
+from functools import lru_cache
+from abstree import AST, EvalError, is_num, is_idtf
+from metrics import METRICS
 
-SEP_RE = re.compile(r'\s*,\s*|\s+')
 WRAP = """The list of {kind}s must be wrapped in parentheses `()`."""
 LEN_MUS = """`{len}` {kind}(s) identified.
 The number of {kind}s must be exactly `{arity}`, the same as the game function."""
@@ -13,18 +13,28 @@ The {kind}s must be {fmt} only, and must be comma- and/or whitespace-separated."
 DUPL = """Duplicate {kind} `{thing}` identified at indices `{j}` and `{i}`.
 The {kind}s must be unique, and must be comma- and/or whitespace-separated."""
 
+CACHE_SIZE = 256
+
 fmt_guild = lambda guild: f"`{guild.name} ({guild.id})`"
 fmt_role = lambda role: f"`@{role.name} ({role.id})`"
+fmt_args = lambda args: f"({', '.join(map(str, args))})"
+
+@lru_cache(maxsize=None)
+def table_format(): # tabulate is only imported for the first table
+    from tabulate import TableFormat, Line, DataRow
+    return TableFormat(
+        lineabove=None,
+        linebelowheader=Line('', '-', '+', ''),
+        linebetweenrows=None,
+        linebelow=None,
+        headerrow=DataRow('', '|', ''),
+        datarow=DataRow('', '|', ''),
+        padding=1,
+        with_header_hide=None)
 
-TBL_FMT = TableFormat(
-    lineabove=None,
-    linebelowheader=Line('', '-', '+', ''),
-    linebetweenrows=None,
-    linebelow=None,
-    headerrow=DataRow('', '|', ''),
-    datarow=DataRow('', '|', ''),
-    padding=1,
-    with_header_hide=None)
+def fmt_table(rows, headers, **kwargs):
+    from tabulate import tabulate
+    return tabulate(rows, headers, table_format(), **kwargs)
 
 def has_ctrl(ctx):
     if ctx.guild is None:
@@ -37,37 +47,75 @@ class ResolveError(Exception):
         super().__init__(msg)
         self.msg = msg
 
+def split_list(items):
+    # comma- and/or whitespace-separated, so each comma with the whitespace around it, or else each whitespace run, separates two items
+    # not abstree.tokenize, which drops whitespace and so cannot give back the raw items the messages quote; str.split is no slower than SEP_RE was
+    if items == '':
+        return []
+    return [item for part in items.split(',') for item in (part.split() or [''])]
+
+@METRICS.timed('resolve_call')
 def resolve_call(call, arity):
     brack = call.find(')')
     if call[0] != '(' or brack == -1:
         raise ResolveError(WRAP.format(kind="argument"))
-    args = SEP_RE.split(call[1:brack].strip())
-    if args == ['']: args = []
+    args = split_list(call[1:brack].strip())
     if len(args) != arity:
         raise ResolveError(LEN_MUS.format(kind="argument", len=len(args), arity=arity))
     for i, arg in enumerate(args):
         if arg == '':
             raise ResolveError(EMPTY.format(kind="argument", i=i, fmt="numeric"))
-        if NUM_RE.fullmatch(arg) is None:
+        if not is_num(arg):
             raise ResolveError(INVLD.format(kind="argument", thing=arg, i=i, fmt="numeric"))
     return list(map(float, args)), call[brack + 1:].strip()
 
-def resolve_func(func, arity=-1):
+@METRICS.timed('resolve_func')
+def resolve_func(func, arity=-1, intern=False):
     brack = func.find(')')
     if func[0] != '(' or brack == -1:
         raise ResolveError(WRAP.format(kind="parameter"))
-    params = SEP_RE.split(func[1:brack].strip())
-    if params == ['']: params = []
+    params = split_list(func[1:brack].strip())
     if arity >= 0 and len(params) != arity:
         raise ResolveError(LEN_MUS.format(kind="parameter", len=len(params), arity=arity))
     idcs = {}
     for i, param in enumerate(params):
         if param == '':
             raise ResolveError(EMPTY.format(kind="parameter", i=i, fmt="alphabetical"))
-        if IDTF_RE.fullmatch(param) is None:
+        if not is_idtf(param):
             raise ResolveError(INVLD.format(kind="parameter", thing=param, i=i, fmt="alphabetical"))
         if param in idcs:
             raise ResolveError(DUPL.format(kind="parameter", thing=param, j=idcs[param], i=i))
         idcs[param] = i
     expr = func[brack + 1:].strip()
-    return params, expr, AST.from_expr(idcs, expr)
+    return params, expr, AST.from_expr(idcs, expr, intern)
+
+class EvalCache:
+    def __init__(self, func, size=CACHE_SIZE):
+        self.func = func
+        self.size = size
+        self.results = OrderedDict() # (args): (result, error message)
+        self.hits = 0
+        self.misses = 0
+    
+    @METRICS.timed('eval')
+    def __call__(self, args):
+        key = tuple(args)
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            rslt, err = self.results[key]
+        else:
+            self.misses += 1
+            try:
+                rslt, err = self.func(args), None
+            except EvalError as error: # only the message, as a kept exception would hold its traceback's frames
+                rslt, err = None, error.msg
+            self.results[key] = rslt, err
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+        if err:
+            raise EvalError(err)
+        return rslt
+
+def verify(dumped, poly, arity, exact): # runs in a verifier.Verifier process
+    return AST.load(dumped).has_poly(poly, arity, exact)
@@ -0,0 +1,76 @@
+import asyncio
+import multiprocessing
+from traceback import print_exc
+import tools
+
+def serve(conn): # worker loop, one job at a time until the pipe closes
+    while True:
+        try:
+            dumped, poly, arity, exact = conn.recv()
+        except EOFError:
+            return
+        conn.send(tools.verify(dumped, poly, arity, exact))
+
+class Verifier:
+    # long-lived worker processes fed over pipes, at most workers busy at once
+    # a worker whose job passes its timeout is killed and replaced, rather than left holding its slot
+    def __init__(self, workers):
+        self.workers = workers
+        self.ctx = None # created on the first job, as not every platform has forkserver
+        self.idle = asyncio.Queue() # (process, connection) of workers waiting for a job
+        self.started = 0 # workers running or being started
+        self.procs = set()
+    
+    def spawn(self):
+        if self.ctx is None:
+            methods = multiprocessing.get_all_start_methods()
+            self.ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if 'forkserver' in methods: # workers fork from a process that has already imported the bot
+                self.ctx.set_forkserver_preload(['__main__', 'tools'])
+        conn, child = self.ctx.Pipe()
+        proc = self.ctx.Process(target=serve, args=(child,), daemon=True)
+        proc.start()
+        child.close()
+        self.procs.add(proc)
+        return proc, conn
+    
+    async def verify(self, timeout, dumped, poly, arity, exact): # timeout counts from the job's start, not its wait for a worker
+        loop = asyncio.get_running_loop()
+        if self.idle.empty() and self.started < self.workers:
+            self.started += 1
+            try:
+                worker = await loop.run_in_executor(None, self.spawn)
+            except Exception:
+                self.started -= 1
+                raise
+        else:
+            worker = await self.idle.get()
+        proc, conn = worker
+        try:
+            conn.send((dumped, poly, arity, exact))
+            if await loop.run_in_executor(None, conn.poll, timeout):
+                rslt = conn.recv()
+                self.idle.put_nowait(worker)
+                return rslt
+        except (EOFError, OSError): # died without a verdict, e.g. out of memory, so treated as not finishing in time
+            pass
+        await self.replace(worker)
+        raise asyncio.TimeoutError
+    
+    async def replace(self, worker):
+        loop = asyncio.get_running_loop()
+        proc, conn = worker
+        proc.kill()
+        conn.close()
+        self.procs.discard(proc)
+        await loop.run_in_executor(None, proc.join)
+        try:
+            self.idle.put_nowait(await loop.run_in_executor(None, self.spawn))
+        except Exception: # the next job starts one instead
+            self.started -= 1
+            print_exc()
+    
+    def close(self):
+        for proc in self.procs:
+            proc.kill()
+    